@@ -2,9 +2,17 @@ import os
 from aiogram import Bot
 from aiogram.dispatcher import Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from src.database.fsm_storage import PostgresStorage
 
 
-storage = MemoryStorage()
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+FSM_STORAGE_TTL = int(os.getenv('FSM_STORAGE_TTL', '86400'))
+FSM_STORAGE_EVICTION_INTERVAL = int(os.getenv('FSM_STORAGE_EVICTION_INTERVAL', '600'))
+match FSM_STORAGE:
+    case 'postgres':
+        storage = PostgresStorage(FSM_STORAGE_TTL, FSM_STORAGE_EVICTION_INTERVAL)
+    case _:
+        storage = MemoryStorage()
 bot = Bot(token=os.getenv('BOT_TOKEN'))
 dp = Dispatcher(bot, storage=storage)
 POSTGRES_USER = os.getenv('POSTGRES_USER')
@@ -18,3 +26,34 @@ IMAGES_COLS = int(os.getenv('IMAGES_COLS'))
 IMAGES_NUMBER = IMAGES_ROWS * IMAGES_COLS
 SCORE_BASIC = float(os.getenv('SCORE_BASIC'))
 STAGES_NUMBER = int(os.getenv('STAGES_NUMBER'))
+GENERATION_CONCURRENCY = int(os.getenv('GENERATION_CONCURRENCY', '32'))
+GENERATION_USER_CONCURRENCY = int(os.getenv('GENERATION_USER_CONCURRENCY', '12'))
+API_CONNECTIONS_LIMIT = int(os.getenv('API_CONNECTIONS_LIMIT', '32'))
+API_KEEPALIVE_TIMEOUT = float(os.getenv('API_KEEPALIVE_TIMEOUT', '60'))
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '5'))
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', '120'))
+GENERATION_TIMEOUT = float(os.getenv('GENERATION_TIMEOUT', '30'))
+API_BACKOFF_BASE = float(os.getenv('API_BACKOFF_BASE', '0.5'))
+API_BACKOFF_MAX = float(os.getenv('API_BACKOFF_MAX', '10'))
+API_BREAKER_THRESHOLD = int(os.getenv('API_BREAKER_THRESHOLD', '5'))
+API_BREAKER_RESET_TIMEOUT = float(os.getenv('API_BREAKER_RESET_TIMEOUT', '30'))
+POSTGRES_POOL_MIN_SIZE = int(os.getenv('POSTGRES_POOL_MIN_SIZE', '2'))
+POSTGRES_POOL_MAX_SIZE = int(os.getenv('POSTGRES_POOL_MAX_SIZE', '10'))
+POSTGRES_STATEMENT_CACHE_SIZE = int(os.getenv('POSTGRES_STATEMENT_CACHE_SIZE', '100'))
+POSTGRES_CONNECT_TIMEOUT = float(os.getenv('POSTGRES_CONNECT_TIMEOUT', '10'))
+POSTGRES_ACQUIRE_TIMEOUT = float(os.getenv('POSTGRES_ACQUIRE_TIMEOUT', '10'))
+POSTGRES_COMMAND_TIMEOUT = float(os.getenv('POSTGRES_COMMAND_TIMEOUT', '30'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '100000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '86400'))
+USER_CACHE_PRELOAD = os.getenv('USER_CACHE_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+RATINGS_QUEUE_SIZE = int(os.getenv('RATINGS_QUEUE_SIZE', '10000'))
+RATINGS_BATCH_SIZE = int(os.getenv('RATINGS_BATCH_SIZE', '500'))
+RATINGS_FLUSH_INTERVAL = float(os.getenv('RATINGS_FLUSH_INTERVAL', '1'))
+GRID_IMAGE_FORMAT = os.getenv('GRID_IMAGE_FORMAT', 'JPEG').upper()
+GRID_IMAGE_QUALITY = int(os.getenv('GRID_IMAGE_QUALITY', '90'))
+IMAGE_PROCESSES = int(os.getenv('IMAGE_PROCESSES', '2'))
+IMAGE_THREADS = int(os.getenv('IMAGE_THREADS', '4'))
+IMAGE_MAX_RUNNING = int(os.getenv('IMAGE_MAX_RUNNING', '8'))
+SEARCH_STRATEGY = os.getenv('SEARCH_STRATEGY', 'weighted')
+SEARCH_CONTRASTIVE_STEP = float(os.getenv('SEARCH_CONTRASTIVE_STEP', '.3'))
+PREFETCH_TTL = float(os.getenv('PREFETCH_TTL', '600'))
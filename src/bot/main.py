@@ -2,18 +2,32 @@ import logging
 from aiogram.utils import executor
 from src.handlers import common
 from src.database import postgres
-from bot_init import dp
+from src.services import api, internal
+from src.database.fsm_storage import PostgresStorage
+from bot_init import dp, USER_CACHE_PRELOAD
 
 
 async def on_startup(_):
-    """Connect to database during bot launch."""
+    """Connect to database, create HTTP session and start image workers during bot launch."""
     await postgres.asyncpg_connect()
+    await postgres.migrate()
+    if USER_CACHE_PRELOAD:
+        await postgres.preload_registered_users()
+    postgres.start_ratings_writer()
+    if isinstance(dp.storage, PostgresStorage):
+        dp.storage.bind(postgres.pool)
+        await common.resume_interrupted_generations(dp.storage)
+    await api.create_session()
+    await internal.image_executor.start(internal.IMAGE_WORKERS)
     logger.info('Bot has been successfully launched!')
 
 
 async def on_shutdown(_):
-    """Disconnect from database during bot shutdown."""
+    """Disconnect from database, close HTTP session and stop image workers during bot shutdown."""
+    await postgres.stop_ratings_writer()
     await postgres.asyncpg_close()
+    await api.close_session()
+    internal.image_executor.shutdown()
     logger.info('Bot has been successfully shut down!')
 
 
@@ -0,0 +1,177 @@
+import argparse
+import json
+import multiprocessing
+import time
+import numpy as np
+from dataclasses import dataclass, field
+from src.evolution.evolver import LatentEvolver
+from src.evolution.strategies import STRATEGIES, get_strategy
+
+
+@dataclass
+class SimulationResult:
+    """Outcome of one simulated generation session."""
+    converged_stage: int | None
+    generator_calls: int = 0
+    generated_images: int = 0
+    stage_times: list[float] = field(default_factory=list)
+    best_scores: list[int] = field(default_factory=list)
+    best_similarities: list[float] = field(default_factory=list)
+
+
+class SyntheticUser:
+    """User who likes faces whose latents point in the same direction as hidden target latent.
+
+    Generator normalizes latent to unit second moment before mapping, so only direction of latent affects the image
+    and the user compares latents by cosine similarity. Score grows linearly from 1 at score_similarity to 10 at
+    perfect_similarity. Random latent has similarity about 0 with std 1 / sqrt(z_dim).
+    """
+
+    def __init__(self,
+                 z_dim: int,
+                 rng: np.random.Generator,
+                 score_similarity: float = 0.,
+                 perfect_similarity: float = .3):
+        self.target = rng.standard_normal(z_dim, dtype=np.float32)
+        self.target /= np.linalg.norm(self.target)
+        self.score_similarity = score_similarity
+        self.perfect_similarity = perfect_similarity
+
+    def similarities(self, latents: np.ndarray) -> np.ndarray:
+        """Return cosine similarities of latents of shape (N, z_dim) to the target."""
+        return latents @ self.target / np.linalg.norm(latents, axis=1)
+
+    def rate(self, similarities: np.ndarray) -> np.ndarray:
+        """Return integer scores from 1 to 10 of latents with specified similarities."""
+        scores = 1 + 9 * (similarities - self.score_similarity) / (self.perfect_similarity - self.score_similarity)
+        return np.clip(np.rint(scores), 1, 10).astype(int)
+
+
+def generate_stub(latents: np.ndarray, args: argparse.Namespace) -> None:
+    """Pretend to generate images, optionally waiting as long as generator would."""
+    if args.stub_delay > 0:
+        time.sleep(args.stub_delay)
+
+
+def generate_api(latents: np.ndarray, args: argparse.Namespace) -> None:
+    """Generate raw images of the whole grid in one request to StyleGAN API."""
+    import requests
+
+    response = requests.post(f'{args.api_url}/generate/batch',
+                             files={'seeds': latents.tobytes()},
+                             params={'size': args.image_size, 'format': 'raw'},
+                             timeout=120)
+    response.raise_for_status()
+
+
+def simulate_session(session_seed: int, args: argparse.Namespace) -> SimulationResult:
+    """Run the same stages as bot handlers with synthetic user picking the best and the worst image of every stage.
+
+    Random picker chooses images regardless of the target, so it is the baseline the feedback loop has to beat.
+    Session converges when the best image of the grid reaches satisfied score.
+    """
+    # User and evolver get independent streams, otherwise the first random latent would be the target itself
+    user_seed, evolver_seed, picker_seed = np.random.SeedSequence(session_seed).spawn(3)
+    user = SyntheticUser(args.z_dim, np.random.default_rng(user_seed), args.score_similarity, args.perfect_similarity)
+    strategy = get_strategy(args.strategy, args.score_basic, args.step)
+    evolver = LatentEvolver(args.z_dim, args.rows, args.cols, strategy, args.noise_scale, args.noise_power, evolver_seed)
+    picker_rng = np.random.default_rng(picker_seed)
+    generate = generate_api if args.generator == 'api' else generate_stub
+    result = SimulationResult(None)
+
+    for stage in range(1, args.stages + 1):
+        started_at = time.perf_counter()
+        latents = evolver.random(args.rows * args.cols) if stage == 1 else evolver.next_latents(stage)
+        generate(latents, args)
+        result.generator_calls += 1
+        result.generated_images += len(latents)
+
+        # User picks images by how they look, i.e. by exact similarity, and only then rates them
+        similarities = user.similarities(latents)
+        scores = user.rate(similarities)
+        match args.picker:
+            case 'random':
+                best, worst = picker_rng.choice(len(latents), 2, replace=False)
+            case _:
+                best, worst = similarities.argmax(), similarities.argmin()
+        evolver.add(latents[best:best + 1], scores[best:best + 1])
+        evolver.add_unattractive(latents[worst:worst + 1], scores[worst:worst + 1])
+        result.stage_times.append(time.perf_counter() - started_at)
+        result.best_scores.append(int(scores.max()))
+        result.best_similarities.append(float(similarities.max()))
+
+        if result.converged_stage is None and scores.max() >= args.satisfied_score:
+            result.converged_stage = stage
+
+    return result
+
+
+def summarize(results: list[SimulationResult], args: argparse.Namespace, wall_time: float) -> dict:
+    """Aggregate results of all sessions."""
+    converged_stages = np.array([result.converged_stage for result in results if result.converged_stage is not None])
+    stage_times = np.array([result.stage_times for result in results])
+    best_scores = np.array([result.best_scores for result in results])
+    best_similarities = np.array([result.best_similarities for result in results])
+
+    return {
+        'sessions': len(results),
+        'picker': args.picker,
+        'strategy': args.strategy,
+        'score_basic': args.score_basic,
+        'noise_scale': args.noise_scale,
+        'noise_power': args.noise_power,
+        'stages': args.stages,
+        'converged_share': len(converged_stages) / len(results),
+        'mean_stages_to_convergence': float(converged_stages.mean()) if len(converged_stages) else None,
+        'median_stages_to_convergence': float(np.median(converged_stages)) if len(converged_stages) else None,
+        'mean_generator_calls': float(np.mean([result.generator_calls for result in results])),
+        'mean_generated_images': float(np.mean([result.generated_images for result in results])),
+        'mean_best_score_per_stage': best_scores.mean(axis=0).round(3).tolist(),
+        'mean_best_similarity_per_stage': best_similarities.mean(axis=0).round(4).tolist(),
+        'mean_stage_time_ms': (stage_times.mean(axis=0) * 1000).round(3).tolist(),
+        'p95_stage_time_ms': float(np.percentile(stage_times, 95) * 1000),
+        'wall_time_s': wall_time
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Simulate generation sessions with synthetic users to tune the feedback loop.')
+    parser.add_argument('--sessions', type=int, default=1000, help='number of simulated sessions')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='number of worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first session, sessions use consecutive seeds')
+    parser.add_argument('--z-dim', type=int, default=512, help='size of latent')
+    parser.add_argument('--rows', type=int, default=4, help='IMAGES_ROWS')
+    parser.add_argument('--cols', type=int, default=3, help='IMAGES_COLS')
+    parser.add_argument('--stages', type=int, default=10, help='STAGES_NUMBER')
+    parser.add_argument('--score-basic', type=float, default=2., help='SCORE_BASIC')
+    parser.add_argument('--noise-scale', type=float, default=.1, help='std of noise in the first evolved row')
+    parser.add_argument('--noise-power', type=float, default=2., help='the i-th row gets (i + 1) ** power times more noise')
+    parser.add_argument('--strategy', choices=list(STRATEGIES), default='weighted', help='SEARCH_STRATEGY')
+    parser.add_argument('--step', type=float, default=.3, help='SEARCH_CONTRASTIVE_STEP')
+    parser.add_argument('--satisfied-score', type=int, default=7, help='score of the best image at which session converges')
+    parser.add_argument('--score-similarity', type=float, default=0.,
+                        help='cosine similarity to target which synthetic user scores 1')
+    parser.add_argument('--perfect-similarity', type=float, default=.3,
+                        help='cosine similarity to target which synthetic user scores 10')
+    parser.add_argument('--picker', choices=['user', 'random'], default='user',
+                        help='synthetic user picks images by similarity, random picker gives baseline')
+    parser.add_argument('--generator', choices=['stub', 'api'], default='stub', help='pretend to generate or call StyleGAN API')
+    parser.add_argument('--stub-delay', type=float, default=0., help='seconds stub generator waits per stage')
+    parser.add_argument('--api-url', default='http://localhost:8000', help='StyleGAN API address')
+    parser.add_argument('--image-size', type=int, default=512, help='side of images requested from API')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started_at = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(simulate_session,
+                               ((args.seed + idx, args) for idx in range(args.sessions)),
+                               chunksize=max(1, args.sessions // (args.processes * 4)))
+
+    print(json.dumps(summarize(results, args, time.perf_counter() - started_at), indent=4))
+
+
+if __name__ == '__main__':
+    main()
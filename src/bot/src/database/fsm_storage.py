@@ -0,0 +1,195 @@
+import asyncio
+import base64
+import json
+import logging
+import typing
+import asyncpg
+from aiogram.dispatcher.storage import BaseStorage
+
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_bytes(value: object) -> dict:
+    """Encode bytes (e.g. packed seeds) as tagged base64 string for JSON."""
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode()}
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _decode_bytes(value: dict) -> dict | bytes:
+    """Decode tagged base64 strings produced by _encode_bytes."""
+    if '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+
+    return value
+
+
+class PostgresStorage(BaseStorage):
+    """FSM storage keeping sessions in PostgreSQL, so they survive bot restarts.
+
+    Sessions which haven't been updated for ttl seconds are considered expired and are periodically deleted.
+    Nothing is cached in process, so memory footprint doesn't depend on number of sessions.
+    """
+
+    def __init__(self, ttl: int = 86400, eviction_interval: int = 600):
+        """
+        :param ttl: idle time in seconds after which session is evicted, defaults to 86400
+        :param eviction_interval: period of expired sessions deletion in seconds, defaults to 600
+        """
+        self.ttl = ttl
+        self.eviction_interval = eviction_interval
+        self._db: asyncpg.Pool | None = None
+        self._eviction_task: asyncio.Task | None = None
+
+    def bind(self, db: asyncpg.Pool) -> None:
+        """Use database connection pool of the bot and start eviction of expired sessions.
+
+        Storage is called concurrently by every update, so single connection would fail with
+        'another operation is in progress' and is rejected.
+
+        :raises TypeError: db is not a connection pool
+        """
+        if not isinstance(db, asyncpg.Pool):
+            raise TypeError(f'FSM storage needs asyncpg.Pool, not {type(db).__name__}!')
+
+        self._db = db
+        self._eviction_task = asyncio.create_task(self._evict_periodically())
+
+    async def _evict_periodically(self) -> None:
+        while True:
+            try:
+                deleted = await self._db.execute(
+                    '''
+                    DELETE FROM fsm_storage
+                    WHERE update_date < CURRENT_TIMESTAMP - $1::INT * INTERVAL '1 second';
+                    ''',
+                    self.ttl
+                )
+                logger.info(f'Expired FSM sessions have been evicted: {deleted}')
+
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+                logger.exception('Expired FSM sessions have not been evicted!')
+
+            await asyncio.sleep(self.eviction_interval)
+
+    async def close(self):
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
+
+    async def wait_closed(self):
+        if self._eviction_task is not None:
+            try:
+                await self._eviction_task
+            except asyncio.CancelledError:
+                pass
+
+    async def _fetch_record(self, chat: int, user: int) -> asyncpg.Record | None:
+        return await self._db.fetchrow(
+            '''
+            SELECT state, data
+            FROM fsm_storage
+            WHERE chat_id = $1 AND user_id = $2 AND update_date >= CURRENT_TIMESTAMP - $3::INT * INTERVAL '1 second';
+            ''',
+            chat, user, self.ttl
+        )
+
+    async def get_addresses(self, states: list[str]) -> list[tuple[int, int]]:
+        """Return (chat, user) pairs of unexpired sessions which are in one of the states."""
+        records = await self._db.fetch(
+            '''
+            SELECT chat_id, user_id
+            FROM fsm_storage
+            WHERE state = ANY($1::TEXT[]) AND update_date >= CURRENT_TIMESTAMP - $2::INT * INTERVAL '1 second';
+            ''',
+            states, self.ttl
+        )
+
+        return [(record['chat_id'], record['user_id']) for record in records]
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._fetch_record(int(chat), int(user))
+        if record is None or record['state'] is None:
+            return self.resolve_state(default)
+
+        return record['state']
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._fetch_record(int(chat), int(user))
+        if record is None:
+            return dict(default or {})
+
+        return json.loads(record['data'], object_hook=_decode_bytes)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._db.execute(
+            '''
+            INSERT INTO fsm_storage (chat_id, user_id, state)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (chat_id, user_id) DO UPDATE
+            SET state = EXCLUDED.state,
+                data = CASE WHEN fsm_storage.update_date < CURRENT_TIMESTAMP - $4::INT * INTERVAL '1 second'
+                            THEN '{}'::JSONB ELSE fsm_storage.data END,
+                update_date = CURRENT_TIMESTAMP;
+            ''',
+            int(chat), int(user), self.resolve_state(state), self.ttl
+        )
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._db.execute(
+            '''
+            INSERT INTO fsm_storage (chat_id, user_id, data)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (chat_id, user_id) DO UPDATE
+            SET data = EXCLUDED.data,
+                state = CASE WHEN fsm_storage.update_date < CURRENT_TIMESTAMP - $4::INT * INTERVAL '1 second'
+                             THEN NULL ELSE fsm_storage.state END,
+                update_date = CURRENT_TIMESTAMP;
+            ''',
+            int(chat), int(user), json.dumps(data or {}, default=_encode_bytes), self.ttl
+        )
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        if data is None:
+            data = {}
+        current_data = await self.get_data(chat=chat, user=user)
+        current_data.update(data, **kwargs)
+        await self.set_data(chat=chat, user=user, data=current_data)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        if not with_data:
+            await self.set_state(chat=chat, user=user, state=None)
+            return
+
+        chat, user = self.check_address(chat=chat, user=user)
+        await self._db.execute(
+            '''
+            DELETE FROM fsm_storage
+            WHERE chat_id = $1 AND user_id = $2;
+            ''',
+            int(chat), int(user)
+        )
@@ -0,0 +1,49 @@
+# init-database.sql only runs on an empty volume, so schema changes made after the first deployment
+# are repeated here as idempotent statements and applied on every bot launch.
+# Fresh databases already match the schema and every statement is a no-op for them.
+MIGRATIONS: list[str] = [
+    # FSM sessions
+    '''
+    CREATE TABLE IF NOT EXISTS fsm_storage (
+        chat_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        state VARCHAR(128),
+        data JSONB NOT NULL DEFAULT '{}',
+        update_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+        PRIMARY KEY (chat_id, user_id)
+    );
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS fsm_storage_idx
+    ON fsm_storage(update_date);
+    ''',
+
+    # Every rating of the session is saved, possibly without image
+    '''
+    DO $$
+    BEGIN
+        CREATE TYPE ratingKindEnum AS ENUM ('attractive', 'unattractive');
+    EXCEPTION
+        WHEN duplicate_object THEN NULL;
+    END
+    $$;
+    ''',
+    '''
+    ALTER TABLE generated_images
+        DROP CONSTRAINT IF EXISTS generated_images_user_id_key,
+        DROP CONSTRAINT IF EXISTS generated_images_model_id_key,
+        ADD COLUMN IF NOT EXISTS stage SMALLINT NOT NULL DEFAULT 1,
+        ADD COLUMN IF NOT EXISTS kind ratingKindEnum NOT NULL DEFAULT 'attractive',
+        ALTER COLUMN image DROP NOT NULL;
+    ''',
+    '''
+    ALTER TABLE generated_images
+        ALTER COLUMN stage DROP DEFAULT,
+        ALTER COLUMN kind DROP DEFAULT;
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS generated_images_idx
+    ON generated_images(user_id);
+    ''',
+]
@@ -1,27 +1,114 @@
+import asyncio
 import asyncpg
 import logging
-from bot_init import POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB
+import time
+from collections import OrderedDict
+from typing import Any
+from src.database.migrations import MIGRATIONS
+from bot_init import POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_DB, POSTGRES_POOL_MIN_SIZE, POSTGRES_POOL_MAX_SIZE, \
+    POSTGRES_STATEMENT_CACHE_SIZE, POSTGRES_CONNECT_TIMEOUT, POSTGRES_ACQUIRE_TIMEOUT, POSTGRES_COMMAND_TIMEOUT, \
+    USER_CACHE_SIZE, USER_CACHE_TTL, RATINGS_QUEUE_SIZE, RATINGS_BATCH_SIZE, RATINGS_FLUSH_INTERVAL
 
 
 logger = logging.getLogger(__name__)
-conn: asyncpg.Connection
+pool: asyncpg.Pool
+
+# Registration is write-once, so registered telegram ids are cached with time of caching in LRU order
+registered_users: OrderedDict[int, float] = OrderedDict()
+
+# Ratings are written in batches by background task, so handlers never wait for inserts
+ratings_queue: asyncio.Queue[tuple[int, str, int, str, int, bytes]]
+ratings_writer_task: asyncio.Task
 
 
 async def asyncpg_connect() -> None:
-    """Initialize asyncpg connection."""
-    global conn
-    conn = await asyncpg.connect(host='postgres', database=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD)
+    """Initialize asyncpg connection pool.
+
+    Every pooled connection caches prepared statements of executed queries. Closed connections
+    (e.g. after PostgreSQL restart) are reestablished by the pool on acquire.
+    """
+    global pool
+    pool = await asyncpg.create_pool(host='postgres',
+                                     database=POSTGRES_DB,
+                                     user=POSTGRES_USER,
+                                     password=POSTGRES_PASSWORD,
+                                     min_size=POSTGRES_POOL_MIN_SIZE,
+                                     max_size=POSTGRES_POOL_MAX_SIZE,
+                                     statement_cache_size=POSTGRES_STATEMENT_CACHE_SIZE,
+                                     timeout=POSTGRES_CONNECT_TIMEOUT,
+                                     command_timeout=POSTGRES_COMMAND_TIMEOUT)
 
-    if conn:
+    if pool:
         logger.info('Database has been successfully connected!')
 
 
+async def migrate() -> None:
+    """Bring schema of existing database up to date in one transaction.
+
+    Advisory lock makes concurrently launched bots apply migrations one after another.
+    """
+    async with pool.acquire(timeout=POSTGRES_ACQUIRE_TIMEOUT) as conn:
+        async with conn.transaction():
+            await conn.execute('SELECT pg_advisory_xact_lock(hashtext(\'migrations\'));')
+            for migration in MIGRATIONS:
+                await conn.execute(migration)
+
+    logger.info(f'{len(MIGRATIONS)} database migrations have been successfully applied!')
+
+
 async def asyncpg_close() -> None:
-    """Close asyncpg connection."""
-    await conn.close()
+    """Close asyncpg connection pool."""
+    await pool.close()
+    logger.info('Database has been successfully disconnected!')
+
+
+async def _query(method: str, query: str, *args) -> Any:
+    """Execute query on pooled connection by its method, retry once if connection has been lost."""
+    for attempt in range(2):
+        try:
+            async with pool.acquire(timeout=POSTGRES_ACQUIRE_TIMEOUT) as conn:
+                return await getattr(conn, method)(query, *args)
+
+        except (asyncpg.ConnectionDoesNotExistError, asyncpg.CannotConnectNowError, ConnectionError) as e:
+            if attempt:
+                raise
+            logger.warning(f'Database connection has been lost, retrying query: {e!r}')
+
 
-    if conn.is_closed():
-        logger.info('Database has been successfully disconnected!')
+async def fetchval(query: str, *args) -> Any:
+    """Execute query and return the first value."""
+    return await _query('fetchval', query, *args)
+
+
+async def fetch(query: str, *args) -> list[asyncpg.Record]:
+    """Execute query and return all records."""
+    return await _query('fetch', query, *args)
+
+
+def cache_registered_user(telegram_id: int) -> None:
+    """Add user to registration cache evicting the least recently used ones."""
+    registered_users[telegram_id] = time.monotonic()
+    registered_users.move_to_end(telegram_id)
+    while len(registered_users) > USER_CACHE_SIZE:
+        registered_users.popitem(last=False)
+
+
+async def preload_registered_users() -> None:
+    """Fill registration cache with the most recently registered users by single query."""
+    records = await fetch(
+        '''
+        SELECT telegram_id
+        FROM users
+        ORDER BY register_date DESC
+        LIMIT $1;
+        ''',
+        USER_CACHE_SIZE
+    )
+
+    for record in reversed(records):
+        cache_registered_user(record['telegram_id'])
+
+    logger.info(f'Registration cache has been preloaded with {len(records)} users!')
 
 
 async def insert_user(name: str,
@@ -35,7 +122,7 @@ async def insert_user(name: str,
         username = '@' + username
 
     
-    return await conn.fetchval(
+    user_id = await fetchval(
         '''
         INSERT INTO users (name, surname, username, telegram_id, sex)
         VALUES ($1, $2, $3, $4, $5)
@@ -43,11 +130,19 @@ async def insert_user(name: str,
         ''',
         name, surname, username, telegram_id, sex
     )
+    cache_registered_user(telegram_id)
+
+    return user_id
 
 
 async def is_user_registered(telegram_id: int) -> bool | None:
-    """Return TRUE if user exists in database else NONE."""
-    return await conn.fetchval(
+    """Return TRUE if user exists in database else NONE. Registered users are cached for USER_CACHE_TTL seconds."""
+    cached_time = registered_users.get(telegram_id)
+    if cached_time is not None and time.monotonic() - cached_time < USER_CACHE_TTL:
+        registered_users.move_to_end(telegram_id)
+        return True
+
+    is_registered = await fetchval(
         '''
         SELECT TRUE
         FROM users
@@ -55,3 +150,93 @@ async def is_user_registered(telegram_id: int) -> bool | None:
         ''',
         telegram_id
     )
+    if is_registered:
+        cache_registered_user(telegram_id)
+    else:
+        registered_users.pop(telegram_id, None)
+
+    return is_registered
+
+
+def enqueue_rating(telegram_id: int,
+                   model: str,
+                   stage: int,
+                   kind: str,
+                   rating: int,
+                   seed: bytes) -> None:
+    """Queue rating of generated image for saving to database without waiting for insert.
+
+    Only seed is saved, image can be regenerated from it.
+
+    :param telegram_id: Telegram user id
+    :param model: 'stylegan3' | 'dcgan'
+    :param stage: stage of generation
+    :param kind: 'attractive' | 'unattractive'
+    :param rating: user score from 1 to 10
+    :param seed: float32 seed bytes
+    """
+    try:
+        ratings_queue.put_nowait((telegram_id, model, stage, kind, rating, seed))
+    except asyncio.QueueFull:
+        logger.error(f'Ratings queue is full, rating of user {telegram_id} has been dropped!')
+
+
+async def write_ratings(ratings: list[tuple[int, str, int, str, int, bytes]]) -> None:
+    """Insert batch of ratings by single executemany call."""
+    async with pool.acquire(timeout=POSTGRES_ACQUIRE_TIMEOUT) as conn:
+        await conn.executemany(
+            '''
+            INSERT INTO generated_images (user_id, model_id, stage, kind, rating, seed)
+            SELECT users.id, models.id, $3, $4, $5, $6
+            FROM users, models
+            WHERE users.telegram_id = $1 AND models.name = $2;
+            ''',
+            ratings
+        )
+
+
+async def write_ratings_periodically() -> None:
+    """Wait for ratings, gather them for RATINGS_FLUSH_INTERVAL seconds and write in batches."""
+    while True:
+        ratings = [await ratings_queue.get()]
+        await asyncio.sleep(RATINGS_FLUSH_INTERVAL)
+        while not ratings_queue.empty() and len(ratings) < RATINGS_BATCH_SIZE:
+            ratings.append(ratings_queue.get_nowait())
+
+        try:
+            await write_ratings(ratings)
+        except Exception:
+            # Any error must not end the writer, otherwise the queue fills up and ratings are dropped silently
+            logger.exception(f'{len(ratings)} ratings have not been saved!')
+
+
+def start_ratings_writer() -> None:
+    """Create ratings queue and start background writer."""
+    global ratings_queue, ratings_writer_task
+    ratings_queue = asyncio.Queue(RATINGS_QUEUE_SIZE)
+    ratings_writer_task = asyncio.create_task(write_ratings_periodically())
+
+
+async def stop_ratings_writer() -> None:
+    """Stop background writer and flush ratings left in queue.
+
+    Errors are only logged, so the rest of shutdown (closing pool and HTTP session) still runs.
+    """
+    ratings_writer_task.cancel()
+    try:
+        await ratings_writer_task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception('Ratings writer has failed!')
+
+    ratings = []
+    while not ratings_queue.empty():
+        ratings.append(ratings_queue.get_nowait())
+    if ratings:
+        try:
+            await write_ratings(ratings)
+        except Exception:
+            logger.exception(f'{len(ratings)} ratings have not been flushed!')
+        else:
+            logger.info(f'{len(ratings)} ratings have been flushed!')
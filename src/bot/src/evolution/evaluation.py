@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import asyncpg
+import json
+import os
+import numpy as np
+from dataclasses import dataclass
+from typing import Iterable
+from src.evolution.strategies import STRATEGIES, SearchStrategy, get_strategy
+
+
+@dataclass
+class RecordedSession:
+    """Rated latents of one generation session, the i-th rows belong to the i-th stage."""
+    attractive_latents: np.ndarray
+    attractive_scores: np.ndarray
+    unattractive_latents: np.ndarray
+    unattractive_scores: np.ndarray
+
+
+def sessions_from_records(records: Iterable[tuple[int, int, str, int, bytes]]) -> list[RecordedSession]:
+    """Split ratings saved in generated_images into sessions.
+
+    New session starts when user changes or stage of attractive rating doesn't grow.
+
+    :param records: (user_id, stage, kind, rating, seed) ordered by user_id and id
+    """
+    sessions = []
+    rated: dict[str, tuple[list[bytes], list[int]]] = {}
+    last_user_id, last_stage = None, 0
+
+    def flush() -> None:
+        if rated.get('attractive'):
+            attractive_seeds, attractive_scores = rated['attractive']
+            unattractive_seeds, unattractive_scores = rated.get('unattractive', ([], []))
+            z_dim = len(attractive_seeds[0]) // 4
+            sessions.append(RecordedSession(
+                np.frombuffer(b''.join(attractive_seeds), dtype=np.float32).reshape(-1, z_dim),
+                np.asarray(attractive_scores, dtype=np.float32),
+                np.frombuffer(b''.join(unattractive_seeds), dtype=np.float32).reshape(-1, z_dim),
+                np.asarray(unattractive_scores, dtype=np.float32)
+            ))
+        rated.clear()
+
+    for user_id, stage, kind, rating, seed in records:
+        if user_id != last_user_id or kind == 'attractive' and stage <= last_stage:
+            flush()
+        if kind == 'attractive':
+            last_stage = stage
+        last_user_id = user_id
+        seeds, scores = rated.setdefault(kind, ([], []))
+        seeds.append(bytes(seed))
+        scores.append(rating)
+    flush()
+
+    return sessions
+
+
+def cosine_similarity(latents: np.ndarray, center: np.ndarray) -> np.ndarray:
+    """Return cosine similarity of latents of shape (..., z_dim) to center of shape (z_dim,).
+
+    Generator normalizes latent to unit second moment before mapping, so only its direction affects the image.
+    """
+    norms = np.linalg.norm(latents, axis=-1) * np.linalg.norm(center)
+    return latents @ center / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def evaluate(strategy: SearchStrategy, sessions: Iterable[RecordedSession]) -> dict[str, float]:
+    """Replay sessions and check how well centers chosen by strategy predict ratings of the next stage.
+
+    Center chosen from the first k stages should point closer to attractive latent of stage k + 1 than to unattractive one.
+    Latents are compared by cosine similarity, because their norm doesn't change the image.
+
+    :param strategy: strategy to evaluate
+    :param sessions: recorded sessions
+    :return: number of predictions, share of correctly ordered pairs and mean cosine similarity to the next attractive latent
+    """
+    predictions, correct, similarity_sum = 0, 0, 0.
+    for session in sessions:
+        for stage in range(1, min(len(session.attractive_scores), len(session.unattractive_scores))):
+            center = strategy.center(session.attractive_latents[:stage], session.attractive_scores[:stage],
+                                     session.unattractive_latents[:stage], session.unattractive_scores[:stage])
+            attractive_similarity = float(cosine_similarity(session.attractive_latents[stage], center))
+            unattractive_similarity = float(cosine_similarity(session.unattractive_latents[stage], center))
+
+            predictions += 1
+            correct += attractive_similarity > unattractive_similarity
+            similarity_sum += attractive_similarity
+
+    return {
+        'predictions': predictions,
+        'pairwise_accuracy': correct / predictions if predictions else 0.,
+        'mean_cosine_similarity': similarity_sum / predictions if predictions else 0.
+    }
+
+
+async def load_sessions(dsn: str, model: str) -> list[RecordedSession]:
+    """Load ratings of model saved in generated_images and split them into sessions.
+
+    :param dsn: PostgreSQL connection string
+    :param model: 'stylegan3' | 'dcgan'
+    """
+    conn = await asyncpg.connect(dsn)
+    try:
+        records = await conn.fetch(
+            '''
+            SELECT generated_images.user_id, stage, kind::TEXT, rating, seed
+            FROM generated_images
+            JOIN models ON models.id = generated_images.model_id
+            WHERE models.name = $1
+            ORDER BY generated_images.user_id, generated_images.id;
+            ''',
+            model
+        )
+    finally:
+        await conn.close()
+
+    return sessions_from_records(tuple(record) for record in records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate search strategies on sessions recorded in generated_images.')
+    parser.add_argument('--dsn', default=f'postgresql://{os.getenv("POSTGRES_USER")}:{os.getenv("POSTGRES_PASSWORD")}'
+                                         f'@{os.getenv("POSTGRES_HOST", "postgres")}/{os.getenv("POSTGRES_DB")}',
+                        help='PostgreSQL connection string, defaults to POSTGRES_* environment variables')
+    parser.add_argument('--model', default='stylegan3', help='name of the model from models table')
+    parser.add_argument('--strategies', nargs='+', choices=list(STRATEGIES), default=list(STRATEGIES), help='strategies to evaluate')
+    parser.add_argument('--score-basic', type=float, default=2., help='SCORE_BASIC')
+    parser.add_argument('--step', type=float, default=.3, help='SEARCH_CONTRASTIVE_STEP')
+    args = parser.parse_args()
+
+    sessions = asyncio.run(load_sessions(args.dsn, args.model))
+    print(json.dumps({
+        'sessions': len(sessions),
+        **{name: evaluate(get_strategy(name, args.score_basic, args.step), sessions) for name in args.strategies}
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
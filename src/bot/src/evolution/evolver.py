@@ -0,0 +1,99 @@
+import numpy as np
+from src.evolution.strategies import SearchStrategy, WeightedStrategy
+
+
+class LatentEvolver:
+    """Evolve latents of the next stage from rated latents of the previous ones.
+
+    History is kept as (n, z_dim) float32 matrices with score vectors, so every step is a few numpy calls.
+    Center of evolved latents is chosen by search strategy.
+    Module doesn't depend on bot, so it can be used in tests, benchmarks and simulations.
+    """
+
+    def __init__(self,
+                 z_dim: int,
+                 images_rows: int = 4,
+                 images_cols: int = 3,
+                 strategy: SearchStrategy | None = None,
+                 noise_scale: float = .1,
+                 noise_power: float = 2.,
+                 seed: int | np.random.SeedSequence | None = None):
+        """
+        :param z_dim: size of latent
+        :param images_rows: number of rows in the grid, all of them but the last one are evolved, defaults to 4
+        :param images_cols: number of columns in the grid, defaults to 3
+        :param strategy: search strategy, defaults to None (WeightedStrategy)
+        :param noise_scale: std of noise in the first row, defaults to .1
+        :param noise_power: the i-th row gets (i + 1) ** noise_power times more noise than the first one, defaults to 2.
+        :param seed: seed of random generator, defaults to None (unpredictable)
+        """
+        self.z_dim = z_dim
+        self.images_rows = images_rows
+        self.images_cols = images_cols
+        self.images_number = images_rows * images_cols
+        self.strategy = strategy or WeightedStrategy()
+        self.noise_scale = noise_scale
+        self.noise_power = noise_power
+        self.rng = np.random.default_rng(seed)
+        self.latents = np.empty((0, z_dim), dtype=np.float32)
+        self.scores = np.empty(0, dtype=np.float32)
+        self.unattractive_latents = np.empty((0, z_dim), dtype=np.float32)
+        self.unattractive_scores = np.empty(0, dtype=np.float32)
+
+    def add(self, latents: np.ndarray, scores: np.ndarray | list[float]) -> None:
+        """Append rated attractive latents to history.
+
+        :param latents: float32 array of shape (n, z_dim)
+        :param scores: scores of shape (n,)
+        """
+        self.latents = np.concatenate([self.latents, np.asarray(latents, dtype=np.float32).reshape(-1, self.z_dim)])
+        self.scores = np.concatenate([self.scores, np.asarray(scores, dtype=np.float32)])
+
+    def add_unattractive(self, latents: np.ndarray, scores: np.ndarray | list[float]) -> None:
+        """Append rated unattractive latents to history.
+
+        :param latents: float32 array of shape (n, z_dim)
+        :param scores: scores of shape (n,)
+        """
+        self.unattractive_latents = np.concatenate([self.unattractive_latents,
+                                                    np.asarray(latents, dtype=np.float32).reshape(-1, self.z_dim)])
+        self.unattractive_scores = np.concatenate([self.unattractive_scores, np.asarray(scores, dtype=np.float32)])
+
+    def center(self) -> np.ndarray:
+        """Return center of evolved latents chosen by strategy.
+
+        :raises ValueError: history is empty
+        """
+        return self.strategy.center(self.latents, self.scores, self.unattractive_latents, self.unattractive_scores)
+
+    def random(self, number: int) -> np.ndarray:
+        """Sample number of latents from standard normal distribution."""
+        return self.rng.standard_normal((number, self.z_dim), dtype=np.float32)
+
+    def evolve(self, number: int) -> np.ndarray:
+        """Sample number of latents around center row by row, noise of the i-th row has std noise_scale * (i + 1) ** noise_power.
+
+        :return: float32 array of shape (number, z_dim)
+        """
+        rows = np.arange(number) // self.images_cols
+        scales = (self.noise_scale * (rows + 1) ** self.noise_power).astype(np.float32)
+        return self.center() + self.random(number) * scales[:, None]
+
+    def evolved_number(self, stage: int) -> int:
+        """Return number of evolved latents on stage, the second stage is entirely random."""
+        return 0 if stage == 2 else (self.images_rows - 1) * self.images_cols
+
+    def next_latents(self, stage: int, random_latents: np.ndarray | None = None) -> np.ndarray:
+        """Return latents of the whole grid: evolved rows followed by random ones.
+
+        :param stage: stage the grid is generated for
+        :param random_latents: already sampled random part, e.g. prefetched, defaults to None (sampled here)
+        :return: float32 array of shape (images_number, z_dim)
+        """
+        evolved_number = self.evolved_number(stage)
+        latents = np.empty((self.images_number, self.z_dim), dtype=np.float32)
+        if evolved_number:
+            latents[:evolved_number] = self.evolve(evolved_number)
+        latents[evolved_number:] = self.random(self.images_number - evolved_number) if random_latents is None else random_latents
+
+        return latents
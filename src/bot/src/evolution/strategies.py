@@ -0,0 +1,107 @@
+import numpy as np
+from abc import ABC, abstractmethod
+
+
+class SearchStrategy(ABC):
+    """Strategy choosing center of the next stage latents from rated latents of the previous stages."""
+
+    @classmethod
+    @abstractmethod
+    def from_settings(cls, score_basic: float, contrastive_step: float) -> 'SearchStrategy':
+        """Create strategy taking the settings it uses.
+
+        :param score_basic: base of exponential weight of score
+        :param contrastive_step: step of contrastive strategy
+        """
+
+    @abstractmethod
+    def center(self,
+               attractive_latents: np.ndarray,
+               attractive_scores: np.ndarray,
+               unattractive_latents: np.ndarray,
+               unattractive_scores: np.ndarray) -> np.ndarray:
+        """Return center of the next stage.
+
+        :param attractive_latents: float32 array of shape (n, z_dim) of the most attractive latents of every stage
+        :param attractive_scores: their scores of shape (n,)
+        :param unattractive_latents: float32 array of shape (m, z_dim) of the least attractive latents of every stage
+        :param unattractive_scores: their scores of shape (m,)
+        :return: float32 array of shape (z_dim,)
+        """
+
+
+def weighted_mean(latents: np.ndarray, scores: np.ndarray, score_basic: float) -> np.ndarray:
+    """Return mean of latents weighted by score_basic ** score.
+
+    :raises ValueError: latents are empty
+    """
+    if not len(scores):
+        raise ValueError('History of latents is empty!')
+
+    # Subtracting maximum score keeps weights finite for any scores
+    weights = np.power(score_basic, scores - scores.max(), dtype=np.float32)
+    return weights @ latents / weights.sum()
+
+
+class WeightedStrategy(SearchStrategy):
+    """Move to mean of attractive latents weighted by score_basic ** score, unattractive latents are ignored."""
+
+    def __init__(self, score_basic: float = 2.):
+        """
+        :param score_basic: base of exponential weight of score, defaults to 2.
+        """
+        self.score_basic = score_basic
+
+    @classmethod
+    def from_settings(cls, score_basic, contrastive_step):
+        return cls(score_basic)
+
+    def center(self, attractive_latents, attractive_scores, unattractive_latents, unattractive_scores):
+        return weighted_mean(attractive_latents, attractive_scores, self.score_basic)
+
+
+class ContrastiveStrategy(WeightedStrategy):
+    """Move from weighted mean of attractive latents further away from weighted mean of unattractive ones.
+
+    Lower score of unattractive latent means it is more repulsive, so it is weighted by score_basic ** -score.
+    """
+
+    def __init__(self, score_basic: float = 2., step: float = .3):
+        """
+        :param score_basic: base of exponential weight of score, defaults to 2.
+        :param step: fraction of attractive minus unattractive direction added to attractive mean, defaults to .3
+        """
+        super().__init__(score_basic)
+        self.step = step
+
+    @classmethod
+    def from_settings(cls, score_basic, contrastive_step):
+        return cls(score_basic, contrastive_step)
+
+    def center(self, attractive_latents, attractive_scores, unattractive_latents, unattractive_scores):
+        attractive_center = weighted_mean(attractive_latents, attractive_scores, self.score_basic)
+        if not len(unattractive_scores):
+            return attractive_center
+
+        unattractive_center = weighted_mean(unattractive_latents, -unattractive_scores, self.score_basic)
+        return attractive_center + self.step * (attractive_center - unattractive_center)
+
+
+STRATEGIES: dict[str, type[SearchStrategy]] = {
+    'weighted': WeightedStrategy,
+    'contrastive': ContrastiveStrategy
+}
+
+
+def get_strategy(name: str, score_basic: float = 2., contrastive_step: float = .3) -> SearchStrategy:
+    """Create strategy by name from STRATEGIES passing it the settings it uses.
+
+    :param name: 'weighted' | 'contrastive'
+    :param score_basic: base of exponential weight of score, defaults to 2.
+    :param contrastive_step: step of contrastive strategy, defaults to .3
+    :raises ValueError: unknown strategy
+    """
+    if name not in STRATEGIES:
+        raise ValueError(f'Search strategy {name} is unknown!')
+
+    return STRATEGIES[name].from_settings(score_basic, contrastive_step)
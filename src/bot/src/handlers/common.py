@@ -1,23 +1,31 @@
+import asyncio
 import logging
 import numpy as np
 import re
-from io import BytesIO
 from aiogram import Dispatcher
 from aiogram.types import Message, ReplyKeyboardRemove
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Text
+from aiogram.utils.exceptions import TelegramAPIError
 from src.keyboards import common_kb
 from src.states import common_fsm
 from src.database import postgres
-from src.services import internal, localization as loc
-from bot_init import bot, IMAGES_ROWS, IMAGES_COLS, IMAGES_NUMBER, SCORE_BASIC, STAGES_NUMBER
+from src.database.fsm_storage import PostgresStorage
+from src.services import api, internal, prefetch, session, localization as loc
+from src.evolution.evolver import LatentEvolver
+from src.evolution.strategies import get_strategy
+from bot_init import bot, ADMIN_ID, IMAGES_ROWS, IMAGES_COLS, IMAGES_NUMBER, SCORE_BASIC, STAGES_NUMBER, SEARCH_STRATEGY, \
+    SEARCH_CONTRASTIVE_STEP
 
 
 logger = logging.getLogger(__name__)
 
+search_strategy = get_strategy(SEARCH_STRATEGY, SCORE_BASIC, SEARCH_CONTRASTIVE_STEP)
+
 
 async def fsm_cancel(msg: Message, state: FSMContext):
     """Cancel FSM state and return to main menu."""
+    prefetch.cancel(msg.from_user.id)
     await state.finish()
     await msg.answer(loc.common.msgs['return_to_main_menu'], parse_mode='HTML', reply_markup=common_kb.welcome)
 
@@ -48,11 +56,20 @@ async def welcome_fsm_sex(msg: Message, state: FSMContext):
 
 async def generation_fsm_cancel(msg: Message, state: FSMContext):
     """Cancel FSM state for generation and return to model menu."""
+    prefetch.cancel(msg.from_user.id)
     await state.finish()
     await state.set_state(common_fsm.Model.selection)
     await msg.answer(loc.common.msgs['model_cancel'], parse_mode='HTML', reply_markup=common_kb.model)
 
 
+async def generation_unavailable(msg: Message, state: FSMContext):
+    """Tell user that generator is unavailable and return to model menu."""
+    prefetch.cancel(msg.from_user.id)
+    await state.finish()
+    await state.set_state(common_fsm.Model.selection)
+    await msg.answer(loc.common.msgs['model_generation_unavailable'], parse_mode='HTML', reply_markup=common_kb.model)
+
+
 async def generation_fsm_start(msg: Message, state: FSMContext):
     """Start FSM for images generation and generate images for the first step."""
     if msg.text == loc.common.btns['model_dcgan']:
@@ -74,27 +91,33 @@ async def generation_fsm_start(msg: Message, state: FSMContext):
                       loc.common.btns['model_stylegan']: 512}
     seed_size = seed_size_dict[msg.text]
 
-    seeds_list = [(np.float32(np.random.normal(size=seed_size))).tolist() for _ in range(IMAGES_NUMBER)]
-    images_list = []
-    for idx, seed in enumerate(seeds_list):
-        image = await internal.get_generated_image(model_str, np.array(seed, dtype=np.float32))
-        image = await internal.draw_image_number(image, idx + 1)
-        images_list.append(image)
+    seeds = np.random.normal(size=(IMAGES_NUMBER, seed_size)).astype(np.float32)
+    try:
+        images_list = await internal.get_generated_images(model_str, seeds, msg.from_user.id)
+    except api.APIError:
+        logger.exception('Images for the first stage have not been generated!')
+        await generation_unavailable(msg, state)
+        return
 
+    final_image = await internal.create_general_image(images_list, IMAGES_ROWS, IMAGES_COLS)
+    await msg.answer_photo(final_image)
+
+    # Seeds are saved only after images are shown, see resume_interrupted_generations
     async with state.proxy() as data:
         data['seed_size'] = seed_size
-        data['seeds_list'] = seeds_list
-        data['images_list'] = images_list
+        data['seeds'] = session.pack_seeds(seeds)
         data['model_str'] = model_str
         data['attractive_list'] = []
         data['unattractive_list'] = []
+        logger.debug(f'Session of user {msg.from_user.id} takes {session.session_size(dict(data))} bytes')
 
-    final_image = await internal.create_general_image(images_list, IMAGES_ROWS, IMAGES_COLS)
-    
     await state.set_state(common_fsm.Model.generation_feedback_attractive)
-    await msg.answer_photo(final_image)
     await msg.answer(loc.common.msgs['model_generation_feedback_attractive'], parse_mode='HTML', reply_markup=ReplyKeyboardRemove())
 
+    # The second stage is entirely random, so it is generated while user is rating
+    if STAGES_NUMBER > 1:
+        prefetch.start(model_str, np.random.normal(size=(IMAGES_NUMBER, seed_size)).astype(np.float32), msg.from_user.id)
+
 
 async def generation_feedback_attractive(msg: Message, state: FSMContext):
     """Get and save feedback for attractive image."""
@@ -103,7 +126,9 @@ async def generation_feedback_attractive(msg: Message, state: FSMContext):
         image_number, image_score = map(int, msg.text.split(' '))
 
         async with state.proxy() as data:
-            data['attractive_list'].append([data['images_list'][image_number - 1], data['seeds_list'][image_number - 1], image_score])
+            seeds = session.unpack_seeds(data['seeds'], data['seed_size'])
+            data['attractive_list'].append([seeds[image_number - 1].tobytes(), image_score])
+            postgres.enqueue_rating(msg.from_user.id, data['model_str'], data['stage'], 'attractive', image_score, seeds[image_number - 1].tobytes())
 
         await msg.answer(loc.common.msgs['model_generation_feedback_unattractive'], parse_mode='HTML')
     else:
@@ -113,89 +138,132 @@ async def generation_feedback_attractive(msg: Message, state: FSMContext):
 async def generation_feedback_unattractive(msg: Message, state: FSMContext):
     """Get and save feedback for unattractive image."""
     if re.fullmatch(re.compile(r"^([1-9]|10|11|12)\s([1-9]|10)$"), msg.text):
-        await state.set_state(common_fsm.Model.generation_generate)
+        await state.set_state(common_fsm.Model.generation_in_process)
         image_number, image_score = map(int, msg.text.split(' '))
         
         async with state.proxy() as data:
-            data['unattractive_list'].append([data['images_list'][image_number - 1], data['seeds_list'][image_number - 1], image_score])
+            seeds = session.unpack_seeds(data['seeds'], data['seed_size'])
+            data['unattractive_list'].append([seeds[image_number - 1].tobytes(), image_score])
+            postgres.enqueue_rating(msg.from_user.id, data['model_str'], data['stage'], 'unattractive', image_score, seeds[image_number - 1].tobytes())
 
         await generation_generate(msg, state)
     else:
         await msg.answer(loc.common.msgs['model_generation_feedback_incorrect_input'], parse_mode='HTML')
 
 
-async def generation_generate(msg: Message, state: FSMContext):
-    """Generate images using NVIDIA StyleGAN 3 for all steps except the first one."""
-    async with state.proxy() as data:
-        data['stage'] += 1
+async def generation_end(msg: Message, state: FSMContext):
+    """Regenerate and send the first, the second and the last attractive images, then return to model menu."""
+    await msg.answer(loc.common.msgs['model_generation_end'], parse_mode='HTML')
+    await bot.send_chat_action(msg.from_user.id, 'typing')
 
-        if data['stage'] > STAGES_NUMBER:
-            await msg.answer(loc.common.msgs['model_generation_end'], parse_mode='HTML')
+    async with state.proxy() as data:
+        model_str = data['model_str']
+        shown_list = [data['attractive_list'][idx] for idx in (0, 1, STAGES_NUMBER - 1)]
+
+    shown_seeds = np.stack([np.frombuffer(seed, dtype=np.float32) for seed, _ in shown_list])
+    try:
+        images_list = await internal.get_generated_images(model_str, shown_seeds, msg.from_user.id)
+    except api.APIError:
+        logger.exception('Attractive images have not been regenerated!')
+        await generation_unavailable(msg, state)
+        return
 
-            first_image_bytes = BytesIO()
-            data['attractive_list'][0][0].save(first_image_bytes, format='PNG')
-            first_image_bytes.seek(0)
-            await msg.answer_photo(first_image_bytes, caption=loc.common.msgs['model_generation_end_score_first'].format(data['attractive_list'][0][2]), parse_mode='HTML')
+    captions = ('model_generation_end_score_first', 'model_generation_end_score_second', 'model_generation_end_score_last')
+    for image, [_, score], caption in zip(images_list, shown_list, captions):
+        await msg.answer_photo(await internal.create_single_image(image), caption=loc.common.msgs[caption].format(score), parse_mode='HTML')
 
-            second_image_bytes = BytesIO()
-            data['attractive_list'][1][0].save(second_image_bytes, format='PNG')
-            second_image_bytes.seek(0)
-            await msg.answer_photo(second_image_bytes, caption=loc.common.msgs['model_generation_end_score_second'].format(data['attractive_list'][1][2]), parse_mode='HTML')
+    prefetch.cancel(msg.from_user.id)
+    await state.finish()
+    await state.set_state(common_fsm.Model.selection)
+    await msg.answer(loc.common.msgs['model_generation_thanks'], parse_mode='HTML', reply_markup=common_kb.model)
 
-            last_image_bytes = BytesIO()
-            data['attractive_list'][STAGES_NUMBER - 1][0].save(last_image_bytes, format='PNG')
-            last_image_bytes.seek(0)
-            await msg.answer_photo(last_image_bytes, caption=loc.common.msgs['model_generation_end_score_last'].format(data['attractive_list'][STAGES_NUMBER - 1][2]), parse_mode='HTML')
 
-            await state.finish()
-            await state.set_state(common_fsm.Model.selection)
-            await msg.answer(loc.common.msgs['model_generation_thanks'], parse_mode='HTML', reply_markup=common_kb.model)
+async def generation_generate(msg: Message, state: FSMContext):
+    """Generate images using NVIDIA StyleGAN 3 for all steps except the first one.
 
-            return
-    
+    Stage is saved together with seeds only after images are sent, so generation interrupted by restart
+    is resumed from the last shown stage.
+    """
     await state.set_state(common_fsm.Model.generation_in_process)
 
     async with state.proxy() as data:
-        await msg.answer(loc.common.msgs['model_generation_process'].format(data['stage'], STAGES_NUMBER), parse_mode='HTML', reply_markup=common_kb.generation)
+        stage = data['stage'] + 1
+
+    if stage > STAGES_NUMBER:
+        await generation_end(msg, state)
+        return
+
+    await msg.answer(loc.common.msgs['model_generation_process'].format(stage, STAGES_NUMBER), parse_mode='HTML', reply_markup=common_kb.generation)
     
     await bot.send_chat_action(msg.from_user.id, 'typing')
 
     async with state.proxy() as data:
-        if data['stage'] == 2:
-            seeds_list = [(np.float32(np.random.normal(size=data['seed_size']))).tolist() for _ in range(IMAGES_NUMBER)]
-
+        seed_size = data['seed_size']
+        model_str = data['model_str']
+        evolver = LatentEvolver(seed_size, IMAGES_ROWS, IMAGES_COLS, search_strategy)
+        evolver.add(session.unpack_seeds(b''.join(seed for seed, _ in data['attractive_list']), seed_size),
+                    [score for _, score in data['attractive_list']])
+        evolver.add_unattractive(session.unpack_seeds(b''.join(seed for seed, _ in data['unattractive_list']), seed_size),
+                                 [score for _, score in data['unattractive_list']])
+
+    # The second stage and the last row of other stages don't depend on feedback and may be already generated
+    evolved_seeds_number = evolver.evolved_number(stage)
+    try:
+        prefetched = prefetch.pop(msg.from_user.id, IMAGES_NUMBER - evolved_seeds_number)
+        if prefetched is None:
+            seeds = evolver.next_latents(stage)
+            images_list = await internal.get_generated_images(model_str, seeds, msg.from_user.id)
         else:
-            best_seed = np.zeros(data['seed_size'], dtype=np.float32)
-            score_sum = 0
-            for [_, seed, score] in data['attractive_list']:
-                best_seed += np.array(seed, dtype=np.float32) * SCORE_BASIC ** score
-                score_sum += SCORE_BASIC ** score
-            best_seed /= score_sum
-
-            seeds_list = []
-            for i in range(IMAGES_ROWS - 1):
-                for _ in range(IMAGES_COLS):
-                    noise = np.float32(np.random.normal(scale=((i + 1) ** 2 * .1), size=data['seed_size']))
-                    seeds_list.append((best_seed + noise).tolist())
-
-            for _ in range(IMAGES_COLS):
-                seeds_list.append((np.float32(np.random.normal(size=data['seed_size']))).tolist())
-
-        images_list = []
-        for idx, seed in enumerate(seeds_list):
-            image = await internal.get_generated_image(data['model_str'], np.array(seed, dtype=np.float32))
-            image = await internal.draw_image_number(image, idx + 1)
-            images_list.append(image)
-
-        data['seeds_list'] = seeds_list
-        data['images_list'] = images_list
+            random_seeds, random_images_task = prefetched
+            seeds = evolver.next_latents(stage, random_seeds)
+            evolved_images_list, random_images_list = await asyncio.gather(
+                internal.get_generated_images(model_str, seeds[:evolved_seeds_number], msg.from_user.id),
+                random_images_task
+            )
+            images_list = evolved_images_list + random_images_list
+    except api.APIError:
+        logger.exception('Images for the next stage have not been generated!')
+        await generation_unavailable(msg, state)
+        return
 
     final_image = await internal.create_general_image(images_list, IMAGES_ROWS, IMAGES_COLS)
+    await msg.answer_photo(final_image)
+
+    async with state.proxy() as data:
+        data['stage'] = stage
+        data['seeds'] = session.pack_seeds(seeds)
+        logger.debug(f'Session of user {msg.from_user.id} takes {session.session_size(dict(data))} bytes')
 
     await state.set_state(common_fsm.Model.generation_feedback_attractive)
-    await msg.answer_photo(final_image)
     await msg.answer(loc.common.msgs['model_generation_feedback_attractive'], parse_mode='HTML')
 
+    if stage < STAGES_NUMBER:
+        prefetch.start(model_str, np.random.normal(size=(IMAGES_COLS, seed_size)).astype(np.float32), msg.from_user.id)
+
+
+async def resume_interrupted_generations(storage: PostgresStorage):
+    """Return sessions whose generation was interrupted by bot restart to a state they can continue from.
+
+    Sessions with shown images wait for any message to generate the next stage again, the others return to model menu.
+    """
+    addresses = await storage.get_addresses([common_fsm.Model.generation_in_process.state,
+                                             common_fsm.Model.generation_generate.state])
+    for chat, user in addresses:
+        if 'seeds' in await storage.get_data(chat=chat, user=user):
+            await storage.set_state(chat=chat, user=user, state=common_fsm.Model.generation_generate)
+            text, keyboard = loc.common.msgs['model_generation_interrupted'], common_kb.generation
+        else:
+            await storage.reset_state(chat=chat, user=user)
+            await storage.set_state(chat=chat, user=user, state=common_fsm.Model.selection)
+            text, keyboard = loc.common.msgs['model_generation_interrupted_start'], common_kb.model
+
+        try:
+            await bot.send_message(chat, text, parse_mode='HTML', reply_markup=keyboard)
+        except TelegramAPIError:
+            logger.exception(f'User {user} has not been notified about interrupted generation!')
+
+    logger.info(f'Interrupted generations have been successfully resumed: {len(addresses)}')
+
 
 async def generation_in_process(msg: Message):
     """Send message with information that generation is in process."""
@@ -214,6 +282,7 @@ async def about_project(msg: Message):
 
 async def command_restart(msg: Message, state: FSMContext):
     """Restart bot and send message when /restart command is pressed."""
+    prefetch.cancel(msg.from_user.id)
     await state.finish()
     await msg.answer(loc.common.msgs['restart'], 'HTML', reply_markup=common_kb.welcome)
 
@@ -223,8 +292,16 @@ async def command_help(msg: Message):
     await msg.answer(loc.common.msgs['help'], 'HTML')
 
 
+async def command_stats(msg: Message):
+    """Send load metrics of image executor to administrator when /stats command is pressed."""
+    metrics = internal.image_executor.metrics.to_dict()
+    await msg.answer('<pre>' + '\n'.join(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}'
+                                          for key, value in metrics.items()) + '</pre>', 'HTML')
+
+
 async def command_start(msg: Message, state: FSMContext):
     """Send message when /start command is pressed."""
+    prefetch.cancel(msg.from_user.id)
     await state.finish()
     await msg.answer(loc.common.msgs['start'], 'HTML', reply_markup=common_kb.welcome)
 
@@ -257,7 +334,9 @@ def register_handlers(dp: Dispatcher):
     dp.register_message_handler(command_restart, commands=['restart'], state='*')
     dp.register_message_handler(command_start, commands=['start'], state='*')
     dp.register_message_handler(command_help, commands=['help'], state='*')
+    dp.register_message_handler(command_stats, commands=['stats'], user_id=ADMIN_ID, state='*')
     dp.register_message_handler(generation_feedback_attractive, state=common_fsm.Model.generation_feedback_attractive)
     dp.register_message_handler(generation_feedback_unattractive, state=common_fsm.Model.generation_feedback_unattractive)
     dp.register_message_handler(generation_in_process, state=common_fsm.Model.generation_in_process)
+    dp.register_message_handler(generation_generate, state=common_fsm.Model.generation_generate)
     dp.register_message_handler(unrecognized_messages, state="*")
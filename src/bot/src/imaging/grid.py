@@ -0,0 +1,139 @@
+import logging
+import numpy as np
+from functools import lru_cache
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+
+
+logger = logging.getLogger(__name__)
+
+# Number labels keyed by (number, text pad, font size, text color), rendered once per worker by build_labels
+labels: dict[tuple[int, int, int, tuple], np.ndarray] = {}
+
+
+@lru_cache(maxsize=None)
+def load_font(font_size: int) -> ImageFont.FreeTypeFont:
+    """Load default font of specified size once per process."""
+    return ImageFont.load_default(font_size)
+
+
+def render_label(number: int,
+                 text_pad: int = 16,
+                 font_size: int = 48,
+                 text_fill: tuple = (255, 255, 255)) -> np.ndarray:
+    """Render number on black plate, so it can be stamped on tiles by slice assignment.
+
+    :param number: number to render
+    :param text_pad: pad of the text, defaults to 16
+    :param font_size: size of the font, defaults to 48
+    :param text_fill: color of the text, defaults to (255, 255, 255)
+    :return: uint8 array of shape (H, W, 3)
+    """
+    font = load_font(font_size)
+    bbox = font.getbbox(str(number))
+    text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    label = Image.new('RGB', (text_width + 1, text_pad * 2 + text_height + 1), 'black')
+    ImageDraw.Draw(label).text((0, 0), str(number), fill=text_fill, font=font)
+
+    return np.asarray(label)
+
+
+def build_labels(numbers: int,
+                 text_pad: int = 16,
+                 font_size: int = 48,
+                 text_fill: tuple = (255, 255, 255)) -> None:
+    """Render labels of every image number once per worker, it is used as initializer of image executor.
+
+    :param numbers: labels from 1 to numbers are rendered
+    :param text_pad: pad of the text, defaults to 16
+    :param font_size: size of the font, defaults to 48
+    :param text_fill: color of the text, defaults to (255, 255, 255)
+    """
+    for number in range(1, numbers + 1):
+        labels[(number, text_pad, font_size, text_fill)] = render_label(number, text_pad, font_size, text_fill)
+    logger.debug(f'{numbers} image labels have been successfully rendered!')
+
+
+def draw_image_number(image: np.ndarray,
+                      number: int,
+                      text_pad: int = 16,
+                      font_size: int = 48,
+                      text_fill: tuple = (255, 255, 255)) -> np.ndarray:
+    """Draw number on picture in place by copying its pre-rendered label.
+
+    :param image: writable uint8 array of shape (H, W, 3) where draw
+    :param number: number to draw
+    :param text_pad: pad of the text, defaults to 16
+    :param font_size: size of the font, defaults to 48
+    :param text_fill: color of the text, defaults to (255, 255, 255)
+    """
+    label_key = (number, text_pad, font_size, text_fill)
+    label = labels.get(label_key)
+    if label is None:
+        label = labels[label_key] = render_label(number, text_pad, font_size, text_fill)
+    image[text_pad:text_pad + label.shape[0], text_pad:text_pad + label.shape[1]] = label
+
+    return image
+
+
+def compose_grid(images_list: list[np.ndarray],
+                 image_rows: int = 4,
+                 image_cols: int = 3,
+                 spacing_size: int = 10,
+                 border_size: int = 2,
+                 numbered: bool = True) -> np.ndarray:
+    """Copy images into one preallocated white canvas row by row and number them starting from 1.
+
+    :param images_list: uint8 arrays of shape (H, W, 3)
+    :param image_rows: number of rows, defaults to 4
+    :param image_cols: number of columns, defaults to 3
+    :param spacing_size: space between images, defaults to 10
+    :param border_size: offset of the first image, defaults to 2
+    :param numbered: draw numbers of images, defaults to True
+    :return: uint8 array of shape (rows * (H + spacing), cols * (W + spacing), 3)
+    """
+    image_height_max = max(image.shape[0] for image in images_list)
+    image_width_max = max(image.shape[1] for image in images_list)
+    final_image = np.full(((image_height_max + spacing_size) * image_rows, (image_width_max + spacing_size) * image_cols, 3),
+                          255, dtype=np.uint8)
+
+    for idx, image in enumerate(images_list):
+        y_offset = border_size + (idx // image_cols) * (image_height_max + spacing_size)
+        x_offset = border_size + (idx % image_cols) * (image_width_max + spacing_size)
+        tile = final_image[y_offset:y_offset + image.shape[0], x_offset:x_offset + image.shape[1]]
+        tile[...] = image
+        if numbered:
+            draw_image_number(tile, idx + 1)
+
+    return final_image
+
+
+def encode_image(image: np.ndarray,
+                 image_format: str = 'JPEG',
+                 quality: int = 90) -> BytesIO:
+    """Encode uint8 array of shape (H, W, 3) to file-like object.
+
+    :param image: image to encode
+    :param image_format: 'JPEG' | 'WEBP' | 'PNG', defaults to 'JPEG'
+    :param quality: quality of lossy formats, defaults to 90
+    """
+    image_bytes = BytesIO()
+    match image_format:
+        case 'PNG':
+            Image.fromarray(image).save(image_bytes, format='PNG', compress_level=1)
+        case _:
+            Image.fromarray(image).save(image_bytes, format=image_format, quality=quality)
+    image_bytes.seek(0)
+
+    return image_bytes
+
+
+def render_grid(images_list: list[np.ndarray],
+                image_rows: int = 4,
+                image_cols: int = 3,
+                spacing_size: int = 10,
+                border_size: int = 2,
+                image_format: str = 'JPEG',
+                quality: int = 90) -> bytes:
+    """Compose and encode grid in one job, so only images and the result cross process boundary."""
+    return encode_image(compose_grid(images_list, image_rows, image_cols, spacing_size, border_size), image_format, quality).getvalue()
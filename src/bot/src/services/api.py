@@ -1,26 +1,162 @@
 import aiohttp
+import asyncio
 import logging
+import random
+import time
+from yarl import URL
+from bot_init import API_CONNECTIONS_LIMIT, API_KEEPALIVE_TIMEOUT, API_CONNECT_TIMEOUT, API_TIMEOUT, API_BACKOFF_BASE, API_BACKOFF_MAX, \
+    API_BREAKER_THRESHOLD, API_BREAKER_RESET_TIMEOUT
 
 
 logger = logging.getLogger(__name__)
+session: aiohttp.ClientSession
 
 
-async def post(url: str, files: dict[str, bytes], module_name: str, attempts: int = 3) -> tuple[int, object | None]:
+class APIError(Exception):
+    """Raised when RESTful API can't return data."""
+
+
+class CircuitOpenError(APIError):
+    """Raised without sending request while RESTful API is considered down."""
+
+
+class CircuitBreaker:
+    """Fail fast for reset_timeout seconds after failure_threshold consecutive failed requests.
+
+    Then a single trial request is let through while others keep failing fast until it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = API_BREAKER_THRESHOLD, reset_timeout: float = API_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    def allow(self) -> bool:
+        """Return TRUE if request may be sent. After reset_timeout only one trial request is let through at a time."""
+        if self.opened_at is None:
+            return True
+
+        if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+
+        self.probing = True
+        return True
+
+    def end_probe(self) -> None:
+        """Let the next trial request through after the current one has finished in any way."""
+        self.probing = False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info('Circuit breaker has been closed!')
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.error(f'Circuit breaker has been opened after {self.failures} failures!')
+            self.opened_at = time.monotonic()
+
+
+breakers: dict[str, CircuitBreaker] = {}
+
+
+async def create_session() -> None:
+    """Create long-lived HTTP session with pooled keep-alive connections and cached DNS lookups."""
+    global session
+    connector = aiohttp.TCPConnector(limit=API_CONNECTIONS_LIMIT,
+                                     keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+                                     ttl_dns_cache=300)
+    session = aiohttp.ClientSession(connector=connector,
+                                    timeout=aiohttp.ClientTimeout(total=API_TIMEOUT, connect=API_CONNECT_TIMEOUT))
+    logger.info('HTTP session has been successfully created!')
+
+
+async def close_session() -> None:
+    """Close HTTP session and its connections."""
+    await session.close()
+    logger.info('HTTP session has been successfully closed!')
+
+
+def backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    """Return full-jitter exponential backoff delay, but not less than server's Retry-After."""
+    delay = random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF_BASE * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+
+    return delay
+
+
+async def post(url: str,
+               files: dict[str, bytes],
+               module_name: str,
+               attempts: int = 3,
+               params: dict[str, str | int] | None = None,
+               timeout: float | None = None) -> tuple[int, object | None]:
     """Execute POST HTTP-request and return status code, data with N attempts.
 
+    Server errors and network errors are retried with exponential backoff. Client errors are not retried.
+
     :param url: url endpoint
     :param module_name: module __name__
+    :param params: query parameters, defaults to None
+    :param timeout: total request timeout in seconds, defaults to None (API_TIMEOUT)
+    :raises CircuitOpenError: API has been failing recently, request is not sent
+    :raises APIError: every attempt has failed with network error
     :return: HTTP status code and data
     :rtype: tuple[int, object]
     """
-    timeout = aiohttp.ClientTimeout(total=1200)
+    breaker = breakers.setdefault(URL(url).host, CircuitBreaker())
+    if not breaker.allow():
+        raise CircuitOpenError(f'{module_name}. RESTful API {url} is unavailable!')
+    probe = breaker.probing
+
+    # Trial request is sent once, so recovering API isn't hit by retries
+    try:
+        return await _post_attempts(breaker, url, files, module_name, 1 if probe else attempts, params, timeout)
+    finally:
+        if probe:
+            breaker.end_probe()
+
+
+async def _post_attempts(breaker: CircuitBreaker,
+                         url: str,
+                         files: dict[str, bytes],
+                         module_name: str,
+                         attempts: int,
+                         params: dict[str, str | int] | None,
+                         timeout: float | None) -> tuple[int, object | None]:
+    """Send request up to attempts times and record outcome in circuit breaker."""
+    # aiohttp treats timeout=None as no timeout at all, so session default is only overridden when timeout is set
+    request_kwargs = {'timeout': aiohttp.ClientTimeout(total=timeout, connect=API_CONNECT_TIMEOUT)} if timeout else {}
+    status, retry_after, error = None, None, None
     for i in range(attempts):
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, data=files, timeout=timeout) as response:
+        try:
+            async with session.post(url, data=files, params=params, **request_kwargs) as response:
+                status, retry_after, error = response.status, response.headers.get('Retry-After'), None
                 if response.status == 200:
+                    breaker.record_success()
                     return response.status, await response.read()
-                
-                else:
-                    logger.error(f'{module_name}. Attempt {i + 1}/{attempts}. RESTful API error {response.status}: {await response.text()}')
-    
-    return response.status, None
\ No newline at end of file
+
+                logger.error(f'{module_name}. Attempt {i + 1}/{attempts}. RESTful API error {response.status}: {await response.text()}')
+                if response.status < 500 and response.status != 429:
+                    # API has answered, so it is up even though request is wrong
+                    breaker.record_success()
+                    return response.status, None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status, retry_after, error = None, None, e
+            logger.error(f'{module_name}. Attempt {i + 1}/{attempts}. Network error: {e!r}')
+
+        if i + 1 < attempts:
+            await asyncio.sleep(backoff_delay(i, retry_after))
+
+    breaker.record_failure()
+    if error is not None:
+        raise APIError(f'{module_name}. RESTful API {url} is unreachable: {error!r}')
+
+    return status, None
@@ -0,0 +1,81 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, asdict
+from typing import Any, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExecutorMetrics:
+    """Counters describing load of executor."""
+    jobs: int = 0
+    failed: int = 0
+    running: int = 0
+    queue_depth: int = 0
+    max_queue_depth_seen: int = 0
+    wait_time: float = 0.
+    run_time: float = 0.
+
+    def to_dict(self) -> dict[str, Any]:
+        metrics = asdict(self)
+        metrics['mean_wait_time'] = self.wait_time / self.jobs if self.jobs else 0.
+        metrics['mean_run_time'] = self.run_time / self.jobs if self.jobs else 0.
+        return metrics
+
+
+class BoundedExecutor:
+    """Run blocking callables in executor with a bounded number of running jobs, others wait in the event loop."""
+
+    def __init__(self, executor: Executor, max_running: int):
+        """
+        :param executor: thread or process pool running the jobs
+        :param max_running: maximum number of submitted and not yet finished jobs
+        """
+        self.executor = executor
+        self.max_running = max_running
+        self.metrics = ExecutorMetrics()
+        self._semaphore = asyncio.Semaphore(max_running)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run func in executor without blocking event loop, waiting for a free slot if max_running jobs are submitted."""
+        queued_at = time.perf_counter()
+        self.metrics.queue_depth += 1
+        self.metrics.max_queue_depth_seen = max(self.metrics.max_queue_depth_seen, self.metrics.queue_depth)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.metrics.queue_depth -= 1
+
+        started_at = time.perf_counter()
+        self.metrics.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            self.metrics.failed += 1
+            raise
+        finally:
+            self._semaphore.release()
+            self.metrics.running -= 1
+            self.metrics.jobs += 1
+            self.metrics.wait_time += started_at - queued_at
+            self.metrics.run_time += time.perf_counter() - started_at
+
+    async def start(self, workers: int) -> None:
+        """Start every worker of the pool in advance by keeping workers jobs busy at the same time.
+
+        Pools start workers on demand, one per job submitted while no worker is idle, so a single job would start one worker.
+        Spawned workers import their modules for a while, so it is done during launch, not by the first users.
+
+        :param workers: max_workers of the pool
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, time.sleep, .1) for _ in range(workers)))
+
+    def shutdown(self) -> None:
+        """Shut down underlying executor."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
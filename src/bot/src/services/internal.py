@@ -1,21 +1,45 @@
+import asyncio
 import logging
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
+from weakref import WeakValueDictionary
+from src.imaging import grid
 from src.services import api
+from src.services.executors import BoundedExecutor
+from bot_init import GENERATION_CONCURRENCY, GENERATION_USER_CONCURRENCY, GENERATION_TIMEOUT, GRID_IMAGE_FORMAT, GRID_IMAGE_QUALITY, IMAGE_PROCESSES, \
+    IMAGE_THREADS, IMAGE_MAX_RUNNING, IMAGES_NUMBER
 
 
 logger = logging.getLogger(__name__)
+generation_semaphore = asyncio.Semaphore(GENERATION_CONCURRENCY)
+user_generation_semaphores: WeakValueDictionary[int, asyncio.Semaphore] = WeakValueDictionary()
+
+# Grid composition and encoding are CPU-bound, so they run off the event loop.
+# Workers are spawned, because forking process with running threads may deadlock them, and render labels once on start.
+# Jobs are functions of src.imaging, which doesn't import bot_init, so workers don't need bot configuration
+IMAGE_WORKERS = IMAGE_PROCESSES or IMAGE_THREADS
+if IMAGE_PROCESSES > 0:
+    image_executor = BoundedExecutor(ProcessPoolExecutor(IMAGE_PROCESSES, mp_context=multiprocessing.get_context('spawn'),
+                                                         initializer=grid.build_labels, initargs=(IMAGES_NUMBER,)), IMAGE_MAX_RUNNING)
+else:
+    image_executor = BoundedExecutor(ThreadPoolExecutor(IMAGE_THREADS, thread_name_prefix='image',
+                                                        initializer=grid.build_labels, initargs=(IMAGES_NUMBER,)), IMAGE_MAX_RUNNING)
 
 
 async def get_generated_image(model: str,
                               seed: np.ndarray,
-                              resize_ratio: int = 2) -> Image.Image:
+                              image_size: int = 512) -> np.ndarray:
     """Get generated image by API according to model by specified seed.
 
+    Image is downscaled by generator and transferred as raw RGB bytes, so it needs neither decoding nor resizing.
+    It is returned as read-only uint8 array of shape (image_size, image_size, 3) sharing memory with the response.
+
     :param model: 'stylegan' | 'dcgan'
     :param seed: seed to be passed to generator using API
-    :param resize_ration: div resize ration, defaults to 2
+    :param image_size: side of the image, defaults to 512
+    :raises api.APIError: generator is unavailable or has returned an error
     """
     seed_bytes = seed.tobytes()
     seed_file = {'seed': seed_bytes}
@@ -24,65 +48,49 @@ async def get_generated_image(model: str,
         case 'dcgan':
             pass
         case 'stylegan3':
-            status_code, data = await api.post('http://stylegan-generator:8000/generate/', seed_file, __name__)
+            status_code, data = await api.post('http://stylegan-generator:8000/generate/', seed_file, __name__,
+                                               params={'size': image_size, 'format': 'raw'}, timeout=GENERATION_TIMEOUT)
     
-    if status_code == 200:
-        image = Image.open(BytesIO(data))
-        image = image.resize((image.width // resize_ratio, image.height // resize_ratio))
-    else:
-        image = Image.new('RGB', (512, 512), 'white')
-    
-    return image
+    if status_code != 200 or len(data) != image_size * image_size * 3:
+        raise api.APIError(f'Generator has returned status {status_code} for {model}!')
+
+    return np.frombuffer(data, dtype=np.uint8).reshape(image_size, image_size, 3)
 
 
-async def draw_image_number(image: Image.Image,
-                            number: int,
-                            text_pad: int = 16,
-                            font_size: int = 48,
-                            text_fill: tuple = (255, 255, 255)) -> Image.Image:
-    """Draw number on picture.
+async def get_generated_images(model: str,
+                               seeds: np.ndarray,
+                               user_id: int,
+                               image_size: int = 512) -> list[np.ndarray]:
+    """Get generated images concurrently by API according to model by specified seeds keeping their order.
 
-    :param image: image where draw
-    :param number: number to draw
-    :param text_pad: pad of the text, defaults to 16
-    :param font_size: size of the font, defaults to 48
-    :param text_fill: color of the text, defaults to (255, 255, 255)
+    :param model: 'stylegan' | 'dcgan'
+    :param seeds: seeds of shape (N, seed_size) to be passed to generator using API
+    :param user_id: Telegram user id used for per-user concurrency limit
+    :param image_size: side of the images, defaults to 512
+    :raises api.APIError: generator is unavailable or has returned an error
     """
-    draw = ImageDraw.Draw(image)
-    font = ImageFont.load_default(font_size)
-    bbox = font.getbbox(str(number))
-    text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
-    draw.rectangle([text_pad, text_pad, text_pad + text_width, text_pad * 3 + text_height], fill='black')
-    draw.text((text_pad, text_pad), str(number), fill=text_fill, font=font)
+    user_semaphore = user_generation_semaphores.get(user_id)
+    if user_semaphore is None:
+        user_semaphore = asyncio.Semaphore(GENERATION_USER_CONCURRENCY)
+        user_generation_semaphores[user_id] = user_semaphore
+
+    async def get_limited_image(seed: np.ndarray) -> np.ndarray:
+        async with user_semaphore, generation_semaphore:
+            return await get_generated_image(model, seed, image_size)
 
-    return image
+    return await asyncio.gather(*(get_limited_image(seed) for seed in seeds))
 
 
-async def create_general_image(images_list: list[Image.Image],
+async def create_general_image(images_list: list[np.ndarray],
                                image_rows: int = 4,
                                image_cols: int = 3,
                                spacing_size: int = 10,
                                border_size: int = 2) -> BytesIO:
-    """Create general image from specified list of images."""    
-    image_width_max = max(img.width for img in images_list)
-    image_height_max = max(img.height for img in images_list)
-    final_image_width = (image_width_max + spacing_size) * image_cols
-    final_image_height = (image_height_max + spacing_size) * image_rows
-    final_image = Image.new('RGB', (final_image_width, final_image_height), 'white')
-
-    x_offset = border_size
-    y_offset = border_size
-    counter = 0
-    for img in images_list:
-        final_image.paste(img, (x_offset, y_offset))
-        x_offset += img.width + spacing_size
-        counter += 1
-        if counter % image_cols == 0:
-            x_offset = border_size
-            y_offset += img.height + spacing_size
-
-    final_image_bytes = BytesIO()
-    final_image.save(final_image_bytes, format='PNG')
-    final_image_bytes.seek(0)
-
-    return final_image_bytes
+    """Create general image with numbered images from specified list of images in image executor."""
+    return BytesIO(await image_executor.run(grid.render_grid, images_list, image_rows, image_cols, spacing_size, border_size,
+                                            GRID_IMAGE_FORMAT, GRID_IMAGE_QUALITY))
+
+
+async def create_single_image(image: np.ndarray) -> BytesIO:
+    """Encode single image in image executor."""
+    return BytesIO((await image_executor.run(grid.encode_image, image, GRID_IMAGE_FORMAT, GRID_IMAGE_QUALITY)).getvalue())
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import numpy as np
+from src.services import internal
+from bot_init import PREFETCH_TTL
+
+
+logger = logging.getLogger(__name__)
+
+# Tasks can't be serialized into FSM storage, so they are kept in process keyed by Telegram user id.
+# Generations nobody takes within PREFETCH_TTL seconds are dropped by timer, so users who walk away don't leak images
+pending_generations: dict[int, tuple[np.ndarray, asyncio.Task, asyncio.TimerHandle]] = {}
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    """Mark exception of background task as retrieved, so discarded failures are only logged once."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f'Speculative generation has failed: {task.exception()!r}')
+
+
+def start(model: str, seeds: np.ndarray, user_id: int) -> None:
+    """Start generating feedback-independent images of the next stage in background.
+
+    :param model: 'stylegan' | 'dcgan'
+    :param seeds: seeds of shape (N, seed_size) which do not depend on user feedback
+    :param user_id: Telegram user id
+    """
+    cancel(user_id)
+    task = asyncio.create_task(internal.get_generated_images(model, seeds, user_id))
+    task.add_done_callback(_retrieve_exception)
+    expiration = asyncio.get_running_loop().call_later(PREFETCH_TTL, _expire, user_id, task)
+    pending_generations[user_id] = (seeds, task, expiration)
+
+
+def _expire(user_id: int, task: asyncio.Task) -> None:
+    """Drop speculative generation which hasn't been taken in time, unless it has been replaced by newer one."""
+    pending = pending_generations.get(user_id)
+    if pending is not None and pending[1] is task:
+        del pending_generations[user_id]
+        task.cancel()
+        logger.debug(f'Speculative generation of user {user_id} has expired')
+
+
+def pop(user_id: int, seeds_number: int) -> tuple[np.ndarray, asyncio.Task] | None:
+    """Take speculative generation of the user if it has expected number of seeds and hasn't failed.
+
+    :param user_id: Telegram user id
+    :param seeds_number: number of feedback-independent seeds needed for the stage
+    :return: seeds and task returning their images or None
+    """
+    pending = pending_generations.pop(user_id, None)
+    if pending is None:
+        return None
+
+    seeds, task, expiration = pending
+    expiration.cancel()
+    if len(seeds) != seeds_number or (task.done() and (task.cancelled() or task.exception() is not None)):
+        task.cancel()
+        return None
+
+    return seeds, task
+
+
+def cancel(user_id: int) -> None:
+    """Cancel speculative generation of the user if any."""
+    pending = pending_generations.pop(user_id, None)
+    if pending is not None:
+        _, task, expiration = pending
+        expiration.cancel()
+        task.cancel()
@@ -0,0 +1,23 @@
+import sys
+import numpy as np
+
+
+def pack_seeds(seeds: np.ndarray) -> bytes:
+    """Pack seeds of shape (N, seed_size) into one contiguous float32 blob."""
+    return np.ascontiguousarray(seeds, dtype=np.float32).tobytes()
+
+
+def unpack_seeds(seeds_bytes: bytes, seed_size: int) -> np.ndarray:
+    """Unpack float32 blob into read-only seeds of shape (N, seed_size) without copying."""
+    return np.frombuffer(seeds_bytes, dtype=np.float32).reshape(-1, seed_size)
+
+
+def session_size(data: object) -> int:
+    """Return approximate number of bytes taken by FSM session data including nested containers."""
+    size = sys.getsizeof(data)
+    if isinstance(data, dict):
+        size += sum(session_size(key) + session_size(value) for key, value in data.items())
+    elif isinstance(data, (list, tuple, set)):
+        size += sum(session_size(item) for item in data)
+
+    return size
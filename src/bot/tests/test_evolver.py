@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from src.evolution.evolver import LatentEvolver
+
+
+Z_DIM = 8
+ROWS, COLS = 4, 3
+SCORE_BASIC = 2.
+
+
+def rated_evolver(seed: int | None = None) -> LatentEvolver:
+    """Evolver with three rated stages, strategy is the default weighted one."""
+    rng = np.random.default_rng(0)
+    evolver = LatentEvolver(Z_DIM, ROWS, COLS, seed=seed)
+    evolver.add(rng.standard_normal((3, Z_DIM), dtype=np.float32), [7, 9, 4])
+    evolver.add_unattractive(rng.standard_normal((3, Z_DIM), dtype=np.float32), [2, 1, 3])
+    return evolver
+
+
+def test_center_matches_baseline_loop():
+    evolver = rated_evolver()
+
+    # Weighted mean as it was computed in handlers before evolver
+    best_seed = np.zeros(Z_DIM, dtype=np.float32)
+    score_sum = 0
+    for seed, score in zip(evolver.latents, evolver.scores):
+        best_seed += seed * SCORE_BASIC ** score
+        score_sum += SCORE_BASIC ** score
+    best_seed /= score_sum
+
+    np.testing.assert_allclose(evolver.center(), best_seed, rtol=1e-5)
+
+
+def test_second_stage_is_entirely_random():
+    latents = rated_evolver(seed=1).next_latents(2)
+
+    assert latents.shape == (ROWS * COLS, Z_DIM)
+    assert latents.dtype == np.float32
+    assert rated_evolver().evolved_number(2) == 0
+
+
+def test_later_stages_evolve_all_rows_but_the_last():
+    evolver = rated_evolver(seed=1)
+    latents = evolver.next_latents(3)
+    evolved_number = evolver.evolved_number(3)
+
+    assert latents.shape == (ROWS * COLS, Z_DIM)
+    assert evolved_number == (ROWS - 1) * COLS
+
+    # Noise of evolved rows grows row by row, so the first row is the closest to center
+    distances = np.linalg.norm(latents[:evolved_number] - evolver.center(), axis=1).reshape(ROWS - 1, COLS)
+    assert distances[0].max() < distances[-1].min()
+
+
+def test_seeded_runs_are_deterministic():
+    np.testing.assert_array_equal(rated_evolver(seed=42).next_latents(3), rated_evolver(seed=42).next_latents(3))
+    assert not np.array_equal(rated_evolver(seed=42).next_latents(3), rated_evolver(seed=43).next_latents(3))
+
+
+def test_random_latents_are_used_unchanged():
+    evolver = rated_evolver(seed=1)
+    random_latents = np.random.default_rng(2).standard_normal((COLS, Z_DIM), dtype=np.float32)
+    latents = evolver.next_latents(3, random_latents)
+
+    np.testing.assert_array_equal(latents[evolver.evolved_number(3):], random_latents)
+
+
+def test_empty_history_raises():
+    with pytest.raises(ValueError):
+        LatentEvolver(Z_DIM, ROWS, COLS).center()
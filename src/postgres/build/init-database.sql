@@ -22,15 +22,37 @@ INSERT INTO models(name) VALUES('dcgan');
 INSERT INTO models(name) VALUES('stylegan3');
 
 
+CREATE TYPE ratingKindEnum AS ENUM ('attractive', 'unattractive');
 CREATE TABLE generated_images (
 	id SERIAL PRIMARY KEY,
-	user_id INT UNIQUE NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-	model_id SMALLINT UNIQUE NOT NULL REFERENCES models(id) ON DELETE CASCADE,
+	user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+	model_id SMALLINT NOT NULL REFERENCES models(id) ON DELETE CASCADE,
+	stage SMALLINT NOT NULL,
+	kind ratingKindEnum NOT NULL,
 	rating SMALLINT NOT NULL,
-	image BYTEA NOT NULL,
+	image BYTEA,
 	seed BYTEA NOT NULL,
 	generation_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
 
 	constraint valid_rating
 		check (rating <= 10)
-);
\ No newline at end of file
+);
+
+
+CREATE INDEX generated_images_idx
+ON generated_images(user_id);
+
+
+CREATE TABLE fsm_storage (
+	chat_id BIGINT NOT NULL,
+	user_id BIGINT NOT NULL,
+	state VARCHAR(128),
+	data JSONB NOT NULL DEFAULT '{}',
+	update_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+	PRIMARY KEY (chat_id, user_id)
+);
+
+
+CREATE INDEX fsm_storage_idx
+ON fsm_storage(update_date);
\ No newline at end of file
@@ -0,0 +1,62 @@
+import io
+import numpy as np
+from typing import List, Optional
+from PIL import Image
+
+
+MEDIA_TYPES = {
+    'raw': 'application/octet-stream',
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp'
+}
+DEFAULT_FORMAT = 'png'
+
+
+def negotiate_format(image_format: Optional[str], accept: Optional[str]) -> str:
+    """Choose output format from explicit format parameter or Accept header.
+
+    :param image_format: 'raw' | 'png' | 'jpeg' | 'webp' | None
+    :param accept: value of Accept header
+    """
+    if image_format:
+        return image_format
+
+    if accept:
+        for media_range in accept.split(','):
+            media_type = media_range.split(';')[0].strip()
+            for candidate_format, candidate_media_type in MEDIA_TYPES.items():
+                if media_type == candidate_media_type:
+                    return candidate_format
+
+    return DEFAULT_FORMAT
+
+
+def raw_bytes(images: np.ndarray) -> bytes:
+    """Return uint8 NHWC images as flat bytes, starlette 0.37 renders only bytes and str bodies."""
+    return np.ascontiguousarray(images).tobytes()
+
+
+def encode_images(images: np.ndarray,
+                  image_format: str = DEFAULT_FORMAT,
+                  quality: int = 90,
+                  compress_level: int = 6) -> List[bytes]:
+    """Encode uint8 NHWC images. Module-level so it can be sent to process pool.
+
+    :param images: uint8 array of shape (N, H, W, 3)
+    :param image_format: 'png' | 'jpeg' | 'webp', defaults to 'png'
+    :param quality: JPEG and WebP quality, defaults to 90
+    :param compress_level: PNG compression level from 0 to 9, defaults to 6
+    """
+    if image_format == 'png':
+        save_kwargs = {'format': 'PNG', 'compress_level': compress_level}
+    else:
+        save_kwargs = {'format': image_format.upper(), 'quality': quality}
+
+    images_bytes = []
+    for image in images:
+        img_byte_arr = io.BytesIO()
+        Image.fromarray(image, 'RGB').save(img_byte_arr, **save_kwargs)
+        images_bytes.append(img_byte_arr.getvalue())
+
+    return images_bytes
@@ -1,33 +1,130 @@
 import logging
+import multiprocessing
 import uvicorn
-import io
 import numpy as np
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Header, Depends
+from fastapi.responses import Response
 from src.model import stylegan
+from src.model.batcher import MicroBatcher
+from src.model.executors import BoundedExecutor, QueueFullError
+from src.api import encoding
+from stylegan_init import TRUNCATION_PSI, GENERATION_MAX_BATCH_SIZE, BATCHER_WINDOW_MS, BATCHER_MAX_BATCH_SIZE, BATCHER_MAX_QUEUE_SIZE, \
+    INFERENCE_THREADS, INFERENCE_MAX_PENDING, ENCODE_PROCESSES, ENCODE_THREADS, ENCODE_MAX_PENDING, RETRY_AFTER_SECONDS, \
+    JPEG_QUALITY, PNG_COMPRESS_LEVEL
 
 
 logger = logging.getLogger(__name__)
 
+# Torch runs in a dedicated thread pool, PNG encoding optionally in separate processes
+inference_executor = BoundedExecutor(ThreadPoolExecutor(INFERENCE_THREADS, thread_name_prefix='inference'), INFERENCE_MAX_PENDING)
+if ENCODE_PROCESSES > 0:
+    encode_executor = BoundedExecutor(ProcessPoolExecutor(ENCODE_PROCESSES, mp_context=multiprocessing.get_context('spawn')), ENCODE_MAX_PENDING)
+else:
+    encode_executor = BoundedExecutor(ThreadPoolExecutor(ENCODE_THREADS, thread_name_prefix='encode'), ENCODE_MAX_PENDING)
+batcher = MicroBatcher(stylegan.generate_images, inference_executor, BATCHER_WINDOW_MS, BATCHER_MAX_BATCH_SIZE, BATCHER_MAX_QUEUE_SIZE)
+synthesis_batcher = MicroBatcher(stylegan.synthesize_images, inference_executor, BATCHER_WINDOW_MS, BATCHER_MAX_BATCH_SIZE, BATCHER_MAX_QUEUE_SIZE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load generators once during API launch and warm them up."""
+    stylegan.load_models()
+    stylegan.warm_up()
+    batcher.start()
+    synthesis_batcher.start()
+    logger.info('StyleGAN API has been successfully launched!')
+    yield
+    await batcher.stop()
+    await synthesis_batcher.stop()
+    inference_executor.shutdown()
+    encode_executor.shutdown()
+
 
 app = FastAPI(
-    title='StyleGAN API 1.0'
+    title='StyleGAN API 1.0',
+    lifespan=lifespan
 )
 
 
+def raise_service_unavailable(e: QueueFullError) -> None:
+    """Ask client to retry later when generation queues are full."""
+    logger.warning(f'Request has been rejected: {e}')
+    raise HTTPException(status_code=503, detail={
+        'status': 'error',
+        'data': None,
+        'details': str(e)
+    }, headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+
+
+@dataclass
+class OutputOptions:
+    """Negotiated output format of generated images."""
+    image_format: str
+    quality: int
+    compress_level: int
+
+
+def output_options(image_format: Optional[str] = Query(None, alias='format', pattern='^(raw|png|jpeg|webp)$'),
+                   quality: int = Query(JPEG_QUALITY, ge=1, le=100),
+                   compress_level: int = Query(PNG_COMPRESS_LEVEL, ge=0, le=9),
+                   accept: Optional[str] = Header(None)) -> OutputOptions:
+    """Take output format from format query parameter or Accept header, PNG by default."""
+    return OutputOptions(encoding.negotiate_format(image_format, accept), quality, compress_level)
+
+
+async def images_response(images: np.ndarray, options: OutputOptions, single: bool = False) -> Response:
+    """Return raw or encoded images.
+
+    Raw images are sent as one uint8 NHWC buffer, their shape is listed in X-Image-Shape header.
+    Several encoded images are concatenated, their sizes in bytes are listed in X-Image-Lengths header.
+    """
+    if options.image_format == 'raw':
+        shape = images.shape[1:] if single else images.shape
+        return Response(encoding.raw_bytes(images),
+                        media_type=encoding.MEDIA_TYPES['raw'],
+                        headers={'X-Image-Shape': ','.join(map(str, shape))})
+
+    images_bytes = await encode_executor.run(encoding.encode_images, images, options.image_format, options.quality, options.compress_level)
+    if single:
+        return Response(images_bytes[0], media_type=encoding.MEDIA_TYPES[options.image_format])
+
+    return Response(b''.join(images_bytes),
+                    media_type='application/octet-stream',
+                    headers={'X-Image-Format': options.image_format,
+                             'X-Image-Lengths': ','.join(str(len(image_bytes)) for image_bytes in images_bytes)})
+
+
 @app.post('/generate/')
-async def get_portfolio(seed: UploadFile = File(...)):
+async def get_portfolio(seed: UploadFile = File(...),
+                        truncation_psi: float = Query(TRUNCATION_PSI),
+                        truncation_cutoff: Optional[int] = Query(None, ge=0),
+                        size: Optional[int] = Query(None, ge=8),
+                        options: OutputOptions = Depends(output_options)):
     """Generate image from seed using NVIDIA StyleGAN3."""
     try:
-        content = await seed.read()
-        seed_array = np.frombuffer(content, dtype=np.float32)
-        image = stylegan.generate_image(seed_array)
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-
-        return StreamingResponse(img_byte_arr, media_type='image/png')
-    
+        seed_array = await read_batch(seed, stylegan.get_model().z_dim)
+        if len(seed_array) != 1:
+            raise HTTPException(status_code=422, detail={
+                'status': 'error',
+                'data': None,
+                'details': f'Buffer must contain exactly {stylegan.get_model().z_dim} float32 values!'
+            })
+
+        images = await batcher.submit(seed_array, truncation_psi=truncation_psi, truncation_cutoff=truncation_cutoff,
+                                      image_size=size)
+
+        return await images_response(images, options, single=True)
+
+    except HTTPException:
+        raise
+
+    except QueueFullError as e:
+        raise_service_unavailable(e)
+
     except Exception as e:
         logger.exception('API error in get_data() method!')
         raise HTTPException(status_code=500, detail={
@@ -37,6 +134,137 @@ async def get_portfolio(seed: UploadFile = File(...)):
         })
 
 
+async def read_batch(upload: UploadFile, dim: int) -> np.ndarray:
+    """Read N x dim float32 buffer from uploaded file.
+
+    :raises HTTPException: buffer has wrong size or batch is too large
+    """
+    content = await upload.read()
+    array = np.frombuffer(content, dtype=np.float32)
+    if array.size == 0 or array.size % dim != 0:
+        raise HTTPException(status_code=422, detail={
+            'status': 'error',
+            'data': None,
+            'details': f'Buffer must contain N x {dim} float32 values!'
+        })
+
+    array = array.reshape(-1, dim)
+    if len(array) > GENERATION_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail={
+            'status': 'error',
+            'data': None,
+            'details': f'Batch size {len(array)} exceeds maximum of {GENERATION_MAX_BATCH_SIZE}!'
+        })
+
+    return array
+
+
+@app.post('/generate/batch')
+async def get_portfolio_batch(seeds: UploadFile = File(...),
+                              truncation_psi: float = Query(TRUNCATION_PSI),
+                              truncation_cutoff: Optional[int] = Query(None, ge=0),
+                              size: Optional[int] = Query(None, ge=8),
+                              options: OutputOptions = Depends(output_options)):
+    """Generate batch of images from N x z_dim float32 seeds buffer using NVIDIA StyleGAN3."""
+    try:
+        seeds_array = await read_batch(seeds, stylegan.get_model().z_dim)
+        images = await batcher.submit(seeds_array, truncation_psi=truncation_psi, truncation_cutoff=truncation_cutoff,
+                                      image_size=size)
+
+        return await images_response(images, options)
+
+    except HTTPException:
+        raise
+
+    except QueueFullError as e:
+        raise_service_unavailable(e)
+
+    except Exception as e:
+        logger.exception('API error in get_portfolio_batch() method!')
+        raise HTTPException(status_code=500, detail={
+            'status': 'error',
+            'data': None,
+            'details': str(e)
+        })
+
+
+@app.post('/map')
+async def get_latents(seeds: UploadFile = File(...)):
+    """Map N x z_dim float32 seeds buffer to N x w_dim float32 untruncated latents buffer using StyleGAN3 mapping network."""
+    try:
+        seeds_array = await read_batch(seeds, stylegan.get_model().z_dim)
+        ws_array = await inference_executor.run(stylegan.map_seeds, seeds_array)
+
+        return Response(ws_array.tobytes(),
+                        media_type='application/octet-stream',
+                        headers={'X-Shape': ','.join(map(str, ws_array.shape))})
+
+    except HTTPException:
+        raise
+
+    except QueueFullError as e:
+        raise_service_unavailable(e)
+
+    except Exception as e:
+        logger.exception('API error in get_latents() method!')
+        raise HTTPException(status_code=500, detail={
+            'status': 'error',
+            'data': None,
+            'details': str(e)
+        })
+
+
+@app.post('/synthesize')
+async def get_portfolio_synthesized(ws: UploadFile = File(...),
+                                    truncation_psi: float = Query(TRUNCATION_PSI),
+                                    truncation_cutoff: Optional[int] = Query(None, ge=0),
+                                    size: Optional[int] = Query(None, ge=8),
+                                    options: OutputOptions = Depends(output_options)):
+    """Synthesize batch of images from N x w_dim float32 latents buffer using StyleGAN3 synthesis network."""
+    try:
+        ws_array = await read_batch(ws, stylegan.get_model().w_dim)
+        images = await synthesis_batcher.submit(ws_array, truncation_psi=truncation_psi, truncation_cutoff=truncation_cutoff,
+                                                image_size=size)
+
+        return await images_response(images, options)
+
+    except HTTPException:
+        raise
+
+    except QueueFullError as e:
+        raise_service_unavailable(e)
+
+    except Exception as e:
+        logger.exception('API error in get_portfolio_synthesized() method!')
+        raise HTTPException(status_code=500, detail={
+            'status': 'error',
+            'data': None,
+            'details': str(e)
+        })
+
+
+@app.get('/metrics')
+async def get_metrics():
+    """Return micro-batching and executors settings and counters."""
+    return {
+        'batcher': {
+            'window_ms': batcher.window_ms,
+            'max_batch_size': batcher.max_batch_size,
+            **batcher.metrics.to_dict()
+        },
+        'synthesis_batcher': synthesis_batcher.metrics.to_dict(),
+        'w_cache_size': stylegan.w_cache_size(),
+        'inference_executor': {
+            'pending': inference_executor.pending,
+            'max_pending': inference_executor.max_pending
+        },
+        'encode_executor': {
+            'pending': encode_executor.pending,
+            'max_pending': encode_executor.max_pending
+        }
+    }
+
+
 def fastapi_run():
     """Run FastAPI."""
     uvicorn.run(app, host='0.0.0.0', port=8000)
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import numpy as np
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.model.executors import BoundedExecutor, QueueFullError
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatcherMetrics:
+    """Counters describing how requests have been gathered into batches."""
+    requests: int = 0
+    batches: int = 0
+    images: int = 0
+    max_batch_size_seen: int = 0
+    queue_depth: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        metrics = asdict(self)
+        metrics['mean_batch_size'] = self.images / self.batches if self.batches else 0.
+        return metrics
+
+
+@dataclass
+class _PendingRequest:
+    seeds: np.ndarray
+    options: Tuple[Tuple[str, Any], ...]
+    future: asyncio.Future
+
+
+class MicroBatcher:
+    """Gather latents of concurrent requests for up to window_ms or max_batch_size and run one batched forward.
+
+    Requests are only batched together when their generation options are equal.
+    """
+
+    def __init__(self,
+                 forward: Callable[..., List[Any]],
+                 executor: BoundedExecutor,
+                 window_ms: float = 10.,
+                 max_batch_size: int = 16,
+                 max_queue_size: int = 256):
+        """
+        :param forward: blocking function receiving (N, z_dim) array and options, returning N results
+        :param executor: executor running forward off the event loop
+        :param window_ms: time to wait for more requests after the first one, defaults to 10.
+        :param max_batch_size: maximum number of latents in one forward, defaults to 16
+        :param max_queue_size: maximum number of waiting requests, defaults to 256
+        """
+        self.forward = forward
+        self.executor = executor
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.metrics = BatcherMetrics()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start gathering loop in the running event loop."""
+        self._queue = asyncio.Queue(self.max_queue_size)
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop gathering loop."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, seeds: np.ndarray, **options) -> List[Any]:
+        """Enqueue N x z_dim seeds and wait for their N results.
+
+        :raises QueueFullError: max_queue_size requests are already waiting
+        """
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self._queue.put_nowait(_PendingRequest(seeds, tuple(sorted(options.items())), future))
+        except asyncio.QueueFull:
+            raise QueueFullError(f'Batcher queue is full ({self.max_queue_size})!')
+
+        self.metrics.requests += 1
+        self.metrics.queue_depth = self._queue.qsize()
+
+        return await future
+
+    async def _gather(self) -> List[_PendingRequest]:
+        """Wait for the first request and collect others until window elapses or batch is full."""
+        loop = asyncio.get_event_loop()
+        pending = [await self._queue.get()]
+        batch_size = len(pending[0].seeds)
+        deadline = loop.time() + self.window_ms / 1000
+
+        while batch_size < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+            pending.append(request)
+            batch_size += len(request.seeds)
+
+        self.metrics.queue_depth = self._queue.qsize()
+
+        return pending
+
+    async def _run(self) -> None:
+        while True:
+            pending = await self._gather()
+
+            groups: Dict[Tuple[Tuple[str, Any], ...], List[_PendingRequest]] = {}
+            for request in pending:
+                groups.setdefault(request.options, []).append(request)
+
+            for options, requests in groups.items():
+                try:
+                    await self._run_batch(requests, dict(options))
+                except Exception:
+                    logger.exception('Batch has not been processed!')
+
+    async def _run_batch(self, requests: List[_PendingRequest], options: Dict[str, Any]) -> None:
+        """Run one forward for requests with equal options and send each caller its own results."""
+        requests = [request for request in requests if not request.future.cancelled()]
+        if not requests:
+            return
+
+        try:
+            # Concatenation fails on latents of different sizes, which must only fail this batch, not the gathering loop
+            seeds = np.concatenate([request.seeds for request in requests])
+            self.metrics.batches += 1
+            self.metrics.images += len(seeds)
+            self.metrics.max_batch_size_seen = max(self.metrics.max_batch_size_seen, len(seeds))
+
+            results = await self.executor.run(self.forward, seeds, **options)
+
+        except Exception as e:
+            logger.exception('Batched forward has failed!')
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in requests:
+            if not request.future.done():
+                request.future.set_result(results[offset:offset + len(request.seeds)])
+            offset += len(request.seeds)
@@ -0,0 +1,43 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when no more jobs can be accepted and client should retry later."""
+
+
+class BoundedExecutor:
+    """Run blocking callables in executor with a bounded number of pending jobs."""
+
+    def __init__(self, executor: Executor, max_pending: int):
+        """
+        :param executor: thread or process pool running the jobs
+        :param max_pending: maximum number of submitted and not yet finished jobs
+        """
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run func in executor without blocking event loop.
+
+        :raises QueueFullError: max_pending jobs are already submitted
+        """
+        if self.pending >= self.max_pending:
+            raise QueueFullError(f'Executor queue is full ({self.pending}/{self.max_pending})!')
+
+        self.pending += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        """Shut down underlying executor."""
+        self.executor.shutdown(wait=False)
@@ -1,34 +1,232 @@
 import logging
 import os
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 import pickle
+import threading
 import torch
 import numpy as np
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from PIL import Image
+from torch_utils.ops import bias_act, filtered_lrelu, upfirdn2d
+from stylegan_init import GENERATION_CHUNK_SIZE, DEVICE, TORCH_NUM_THREADS, TORCH_INTEROP_THREADS, W_CACHE_SIZE, \
+    TRUNCATION_PSI, W_AVG_SAMPLES
 
 
 logger = logging.getLogger(__name__)
 
 
 MODEL_PATH = './res'
-MODEL_NAME = 'stylegan3-r-ffhq-1024x1024.pkl'
+MODELS = {'stylegan3': 'stylegan3-r-ffhq-1024x1024.pkl'}
+DEFAULT_MODEL = 'stylegan3'
 CLASS_LABEL = None
 
+device = torch.device(DEVICE)
 
-def generate_image(numpy_seed: np.ndarray) -> Image.Image:
-    with open(os.path.join(MODEL_PATH, MODEL_NAME), 'rb') as f:
-        loaded_model = pickle.load(f)['G_ema'].cuda()
 
-    # SEED_SIZE = loaded_model.z_dim
+# Generators are unpickled once per process and shared by every request
+_registry: Dict[str, torch.nn.Module] = {}
 
-    torch_seed = torch.from_numpy(numpy_seed).reshape(1, -1).cuda()
+# LRU cache of mapping network outputs keyed by model name and seed bytes
+_w_cache: 'OrderedDict[Tuple[str, bytes], np.ndarray]' = OrderedDict()
+_w_cache_lock = threading.Lock()
 
-    # image_seed = torch.randn([1, loaded_model.z_dim]).cuda()
 
-    # NCHW, float32, dynamic range [-1, +1], no truncation
-    generated_image = loaded_model(torch_seed, CLASS_LABEL)
-    generated_image_processed = np.moveaxis(generated_image.cpu().numpy(), 1, -1)
-    generated_image_processed = 0.5 * generated_image_processed + 0.5
+def setup_device() -> None:
+    """Set torch thread counts and force reference implementations of custom ops on CPU."""
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+    if TORCH_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError:
+            logger.warning('Inter-op threads number has already been set!')
 
+    # Never try to build CUDA plugins, ops fall back to their _ref implementations
+    if device.type == 'cpu':
+        for op in (bias_act, filtered_lrelu, upfirdn2d):
+            op._init = lambda: False
 
-    return Image.fromarray((generated_image_processed[0] * 255).astype(np.uint8), 'RGB')
\ No newline at end of file
+    logger.info(f'Device {device} has been selected, torch uses {torch.get_num_threads()} threads!')
+
+
+def load_models() -> None:
+    """Load every generator from MODELS into the registry and keep it resident in eval mode."""
+    setup_device()
+    for model_name, model_file in MODELS.items():
+        if model_name in _registry:
+            continue
+
+        with open(os.path.join(MODEL_PATH, model_file), 'rb') as f:
+            loaded_model = pickle.load(f)['G_ema']
+
+        loaded_model = loaded_model.eval().requires_grad_(False).to(device)
+        if not hasattr(loaded_model.mapping, 'w_avg'):
+            loaded_model.mapping.register_buffer('w_avg', compute_w_avg(loaded_model))
+
+        _registry[model_name] = loaded_model
+        logger.info(f'Model {model_name} has been loaded from {model_file}!')
+
+
+@torch.inference_mode()
+def compute_w_avg(loaded_model: torch.nn.Module, samples: int = W_AVG_SAMPLES) -> torch.Tensor:
+    """Estimate center of W space as mean mapping output of random seeds.
+
+    :param loaded_model: generator without tracked w_avg
+    :param samples: number of random seeds, defaults to W_AVG_SAMPLES
+    """
+    w_sum = torch.zeros(loaded_model.w_dim, device=device)
+    for chunk_start in range(0, samples, 1000):
+        torch_seeds = torch.randn(min(1000, samples - chunk_start), loaded_model.z_dim, device=device)
+        w_sum += loaded_model.mapping(torch_seeds, CLASS_LABEL)[:, 0].sum(dim=0)
+
+    return w_sum / samples
+
+
+def truncate(loaded_model: torch.nn.Module,
+             torch_ws: torch.Tensor,
+             truncation_psi: float = 1.,
+             truncation_cutoff: Optional[int] = None) -> torch.Tensor:
+    """Broadcast N x w_dim latents to every synthesis layer and pull first truncation_cutoff of them towards w_avg.
+
+    :param loaded_model: generator from the registry
+    :param torch_ws: tensor of shape (N, w_dim)
+    :param truncation_psi: 1 means no truncation, 0 means w_avg, defaults to 1.
+    :param truncation_cutoff: number of truncated layers, None means all layers, defaults to None
+    :return: tensor of shape (N, num_ws, w_dim)
+    """
+    num_ws = loaded_model.num_ws
+    if truncation_psi == 1:
+        return torch_ws.unsqueeze(1).expand(-1, num_ws, -1)
+
+    truncated_ws = loaded_model.mapping.w_avg.lerp(torch_ws, truncation_psi)
+    if truncation_cutoff is None or truncation_cutoff >= num_ws:
+        return truncated_ws.unsqueeze(1).expand(-1, num_ws, -1)
+
+    return torch.cat([truncated_ws.unsqueeze(1).expand(-1, truncation_cutoff, -1),
+                      torch_ws.unsqueeze(1).expand(-1, num_ws - truncation_cutoff, -1)], dim=1)
+
+
+def get_model(model_name: str = DEFAULT_MODEL) -> torch.nn.Module:
+    """Return generator from the registry.
+
+    :param model_name: name of the model from MODELS, defaults to DEFAULT_MODEL
+    :raises RuntimeError: model has not been loaded by load_models()
+    """
+    try:
+        return _registry[model_name]
+    except KeyError:
+        raise RuntimeError(f'Model {model_name} is not loaded!')
+
+
+def warm_up() -> None:
+    """Run one forward pass for every loaded generator so the first request isn't the slow one."""
+    for model_name, loaded_model in _registry.items():
+        generate_image(np.zeros(loaded_model.z_dim, dtype=np.float32), model_name)
+        logger.info(f'Model {model_name} has been warmed up!')
+
+
+@torch.inference_mode()
+def map_seeds(numpy_seeds: np.ndarray, model_name: str = DEFAULT_MODEL) -> np.ndarray:
+    """Map N x z_dim seeds to N x w_dim untruncated latents, running mapping network only for seeds missing in cache.
+
+    :param numpy_seeds: float32 array of shape (N, z_dim)
+    :param model_name: name of the model from MODELS, defaults to DEFAULT_MODEL
+    """
+    loaded_model = get_model(model_name)
+    numpy_ws = np.empty((len(numpy_seeds), loaded_model.w_dim), dtype=np.float32)
+
+    missing_idxs = []
+    with _w_cache_lock:
+        for idx, numpy_seed in enumerate(numpy_seeds):
+            cache_key = (model_name, numpy_seed.tobytes())
+            if cache_key in _w_cache:
+                _w_cache.move_to_end(cache_key)
+                numpy_ws[idx] = _w_cache[cache_key]
+            else:
+                missing_idxs.append(idx)
+
+    if missing_idxs:
+        torch_seeds = torch.from_numpy(numpy_seeds[missing_idxs]).to(device)
+
+        # Mapping broadcasts the same w to every synthesis layer, so only the first one is kept
+        numpy_ws[missing_idxs] = loaded_model.mapping(torch_seeds, CLASS_LABEL)[:, 0].cpu().numpy()
+
+        with _w_cache_lock:
+            for idx in missing_idxs:
+                _w_cache[(model_name, numpy_seeds[idx].tobytes())] = numpy_ws[idx].copy()
+            while len(_w_cache) > W_CACHE_SIZE:
+                _w_cache.popitem(last=False)
+
+    return numpy_ws
+
+
+@torch.jit.script
+def postprocess(generated_images: torch.Tensor) -> torch.Tensor:
+    """Scale, clamp, round and cast NCHW images from [-1, +1] to NHWC uint8 as one fused kernel on the device."""
+    return (generated_images * 127.5 + 128).clamp(0, 255).to(torch.uint8).permute(0, 2, 3, 1)
+
+
+@torch.inference_mode()
+def synthesize_images(numpy_ws: np.ndarray,
+                      model_name: str = DEFAULT_MODEL,
+                      truncation_psi: float = TRUNCATION_PSI,
+                      truncation_cutoff: Optional[int] = None,
+                      image_size: Optional[int] = None) -> np.ndarray:
+    """Synthesize N x H x W x 3 uint8 images from N x w_dim latents, running synthesis network in batches of GENERATION_CHUNK_SIZE.
+
+    :param numpy_ws: float32 array of shape (N, w_dim)
+    :param model_name: name of the model from MODELS, defaults to DEFAULT_MODEL
+    :param truncation_psi: truncation strength, defaults to TRUNCATION_PSI
+    :param truncation_cutoff: number of truncated layers, defaults to None (all layers)
+    :param image_size: side of output images capped at model resolution, defaults to None (model resolution)
+    """
+    loaded_model = get_model(model_name)
+
+    resolution = min(image_size or loaded_model.img_resolution, loaded_model.img_resolution)
+
+    # Pinned host buffer lets copy of every chunk overlap with synthesis of the next one
+    images = torch.empty((len(numpy_ws), resolution, resolution, loaded_model.img_channels),
+                         dtype=torch.uint8,
+                         pin_memory=device.type == 'cuda')
+    for chunk_start in range(0, len(numpy_ws), GENERATION_CHUNK_SIZE):
+        torch_ws = torch.from_numpy(numpy_ws[chunk_start:chunk_start + GENERATION_CHUNK_SIZE]).to(device)
+        torch_ws = truncate(loaded_model, torch_ws, truncation_psi, truncation_cutoff)
+
+        # NCHW, float32, dynamic range [-1, +1]
+        generated_images = loaded_model.synthesis(torch_ws, force_fp32=device.type == 'cpu')
+        if resolution != loaded_model.img_resolution:
+            # Area interpolation averages every source pixel, so downsampling is antialiased
+            generated_images = torch.nn.functional.interpolate(generated_images, size=(resolution, resolution), mode='area')
+        images[chunk_start:chunk_start + GENERATION_CHUNK_SIZE].copy_(postprocess(generated_images), non_blocking=True)
+
+    if device.type == 'cuda':
+        torch.cuda.current_stream(device).synchronize()
+
+    return images.numpy()
+
+
+def generate_images(numpy_seeds: np.ndarray,
+                    model_name: str = DEFAULT_MODEL,
+                    truncation_psi: float = TRUNCATION_PSI,
+                    truncation_cutoff: Optional[int] = None,
+                    image_size: Optional[int] = None) -> np.ndarray:
+    """Generate N x H x W x 3 uint8 images from N x z_dim seeds.
+
+    :param numpy_seeds: float32 array of shape (N, z_dim)
+    :param model_name: name of the model from MODELS, defaults to DEFAULT_MODEL
+    :param truncation_psi: truncation strength, defaults to TRUNCATION_PSI
+    :param truncation_cutoff: number of truncated layers, defaults to None (all layers)
+    :param image_size: side of output images capped at model resolution, defaults to None (model resolution)
+    """
+    return synthesize_images(map_seeds(numpy_seeds, model_name), model_name, truncation_psi, truncation_cutoff, image_size)
+
+
+def generate_image(numpy_seed: np.ndarray, model_name: str = DEFAULT_MODEL) -> Image.Image:
+    """Generate single image from seed."""
+    return Image.fromarray(generate_images(numpy_seed.reshape(1, -1), model_name)[0], 'RGB')
+
+
+def w_cache_size() -> int:
+    """Return number of latents stored in mapping cache."""
+    return len(_w_cache)
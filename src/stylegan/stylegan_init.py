@@ -0,0 +1,22 @@
+import os
+
+
+GENERATION_MAX_BATCH_SIZE = int(os.getenv('GENERATION_MAX_BATCH_SIZE', '64'))
+GENERATION_CHUNK_SIZE = int(os.getenv('GENERATION_CHUNK_SIZE', '8'))
+BATCHER_WINDOW_MS = float(os.getenv('BATCHER_WINDOW_MS', '10'))
+BATCHER_MAX_BATCH_SIZE = int(os.getenv('BATCHER_MAX_BATCH_SIZE', '16'))
+BATCHER_MAX_QUEUE_SIZE = int(os.getenv('BATCHER_MAX_QUEUE_SIZE', '256'))
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '1'))
+INFERENCE_MAX_PENDING = int(os.getenv('INFERENCE_MAX_PENDING', '8'))
+ENCODE_PROCESSES = int(os.getenv('ENCODE_PROCESSES', '0'))
+ENCODE_THREADS = int(os.getenv('ENCODE_THREADS', '4'))
+ENCODE_MAX_PENDING = int(os.getenv('ENCODE_MAX_PENDING', '64'))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '1'))
+DEVICE = os.getenv('DEVICE', 'cuda')
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '0'))
+TORCH_INTEROP_THREADS = int(os.getenv('TORCH_INTEROP_THREADS', '0'))
+W_CACHE_SIZE = int(os.getenv('W_CACHE_SIZE', '4096'))
+TRUNCATION_PSI = float(os.getenv('TRUNCATION_PSI', '1'))
+W_AVG_SAMPLES = int(os.getenv('W_AVG_SAMPLES', '10000'))
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '90'))
+PNG_COMPRESS_LEVEL = int(os.getenv('PNG_COMPRESS_LEVEL', '6'))
@@ -0,0 +1,26 @@
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from src.model.batcher import MicroBatcher
+from src.model.executors import BoundedExecutor
+
+
+def test_batch_of_mismatched_latents_does_not_stop_batcher():
+    async def run():
+        executor = BoundedExecutor(ThreadPoolExecutor(1), 8)
+        batcher = MicroBatcher(lambda seeds: seeds.sum(axis=1), executor, window_ms=50)
+        batcher.start()
+        try:
+            # Both requests land in one window, so their latents are concatenated together
+            results = await asyncio.wait_for(asyncio.gather(batcher.submit(np.ones((1, 4), dtype=np.float32)),
+                                                            batcher.submit(np.ones((1, 3), dtype=np.float32)),
+                                                            return_exceptions=True), 1)
+            assert all(isinstance(result, ValueError) for result in results)
+
+            result = await asyncio.wait_for(batcher.submit(np.ones((2, 4), dtype=np.float32)), 1)
+            assert result.tolist() == [4., 4.]
+        finally:
+            await batcher.stop()
+            executor.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from src.api import restful_api
+from src.model import stylegan
+
+
+Z_DIM = 4
+IMAGE_SIZE = 8
+
+
+def generate_images(numpy_seeds: np.ndarray, **options) -> np.ndarray:
+    """Return one gray uint8 image per seed instead of running generator."""
+    return np.full((len(numpy_seeds), IMAGE_SIZE, IMAGE_SIZE, 3), 127, dtype=np.uint8)
+
+
+@pytest.fixture(scope='module')
+def client():
+    """API client with generator replaced, executors are shut down by lifespan, so the client is shared by module."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(stylegan, 'load_models', lambda: None)
+        monkeypatch.setattr(stylegan, 'warm_up', lambda: None)
+        monkeypatch.setattr(stylegan, 'get_model', lambda model_name=stylegan.DEFAULT_MODEL: SimpleNamespace(z_dim=Z_DIM, w_dim=Z_DIM))
+        monkeypatch.setattr(restful_api.batcher, 'forward', generate_images)
+        with TestClient(restful_api.app) as test_client:
+            yield test_client
+
+
+def test_generate_raw_response_renders(client):
+    seed = np.zeros(Z_DIM, dtype=np.float32)
+    response = client.post('/generate/', params={'format': 'raw'}, files={'seed': seed.tobytes()})
+
+    assert response.status_code == 200
+    assert response.headers['X-Image-Shape'] == f'{IMAGE_SIZE},{IMAGE_SIZE},3'
+    assert response.content == generate_images(seed.reshape(1, -1))[0].tobytes()
+
+
+def test_generate_raw_tile_as_requested_by_bot(client):
+    # Bot requests every tile with size and format=raw and reads it with np.frombuffer, so body must be exactly H x W x 3
+    seed = np.random.default_rng(0).standard_normal(Z_DIM, dtype=np.float32)
+    response = client.post('/generate/', params={'size': IMAGE_SIZE, 'format': 'raw'}, files={'seed': seed.tobytes()})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/octet-stream'
+    assert len(response.content) == IMAGE_SIZE * IMAGE_SIZE * 3
+
+
+def test_generate_rejects_seed_of_wrong_size(client):
+    response = client.post('/generate/', params={'format': 'raw'}, files={'seed': np.zeros(Z_DIM - 1, dtype=np.float32).tobytes()})
+    assert response.status_code == 422
+
+    # Batcher must keep serving after malformed request
+    response = client.post('/generate/', params={'format': 'raw'}, files={'seed': np.zeros(Z_DIM, dtype=np.float32).tobytes()})
+    assert response.status_code == 200